@@ -0,0 +1,311 @@
+import json
+import os
+import sqlite3
+
+from converter import (MARCrecordParser, DCrecordParser, iter_marc_records, iter_edm_records,
+                       detect_file_format, extract_year, get_namespaces)
+
+
+# the typed columns of the catalog, as {column: (SQL type, MARC paths, Dublin Core fields)};
+# the values of all listed paths/fields are joined with "; " (the year is taken from the first date)
+catalog_columns = {
+    "title": ("TEXT", ["245$a", "245$b"], ["title"]),
+    "creator": ("TEXT", ["100", "110$a"], ["creator"]),
+    "contributor": ("TEXT", ["700", "710$a"], ["contributor"]),
+    "subject": ("TEXT", ["600", "610$a", "650$a", "651$a", "653$a"], ["subject"]),
+    "publisher": ("TEXT", ["260$b", "264$b"], ["publisher"]),
+    "publication_place": ("TEXT", ["260$a", "264$a"], []),
+    "date": ("TEXT", ["260$c", "264$c"], ["date"]),
+    "year": ("INTEGER", [], []),
+    "language": ("TEXT", ["041$a"], ["language"]),
+    "type": ("TEXT", ["336$a"], ["type"]),
+    "isbn": ("TEXT", ["020$a"], ["isbn"]),
+    "issn": ("TEXT", ["022$a"], []),
+    "udc": ("TEXT", ["080$a"], []),
+}
+
+# the columns indexed for full-text search
+fts_columns = ["title", "creator", "contributor", "subject"]
+
+# the identifier schemes with a secondary index (one row per value in the identifiers table)
+identifier_schemes = ["isbn", "issn", "udc"]
+
+
+def normalize_identifier(scheme: str, value: str) -> str:
+    """
+    Normalizes an identifier for exact lookups: ISBNs and ISSNs lose the "urn:isbn:" prefix, hyphens,
+    spaces and trailing qualifiers (e.g. "(köites)"); UDC numbers are only stripped.
+    """
+    value = value.strip()
+    if scheme in ["isbn", "issn"]:
+        if value.lower().startswith("urn:isbn:"):
+            value = value[len("urn:isbn:"):]
+        value = value.split(" ")[0].split("(")[0]
+        value = value.replace("-", "").upper()
+    return value
+
+
+def column_values(record: dict, format: str, column: str) -> list:
+    """
+    The values of a catalog column in a flattened MARC (with field codes) or Dublin Core record, parsed with
+    multivalue="list" (or "join", in which case the joined values are not split again).
+    """
+    _, marc_paths, dc_fields = catalog_columns[column]
+    if format == "marc":
+        values = [record[path] for path in marc_paths if path in record]
+    else:
+        # include the language-tagged variants, e.g. "title_et"
+        values = [value for key, value in record.items()
+                  if key in dc_fields or key.rsplit("_", 1)[0] in dc_fields]
+    flat_values = []
+    for value in values:
+        if isinstance(value, list):
+            flat_values += value
+        else:
+            flat_values.append(value)
+    return flat_values
+
+
+def catalog_row(record: dict, format: str) -> dict:
+    """Maps a flattened MARC or Dublin Core record to the typed catalog columns (multiple values joined with "; ")."""
+    row = {}
+    for column in catalog_columns:
+        values = column_values(record, format, column)
+        row[column] = "; ".join(values) if values else None
+    dates = column_values(record, format, "date")
+    if format == "edm" and record.get("year") is not None:
+        row["year"] = record["year"]
+    elif dates:
+        row["year"] = extract_year(dates[0])
+    return row
+
+
+def iter_catalog_records(filepath: str):
+    """
+    Streams over a harvested OAI-PMH file and yields (identifier, format, record) tuples, where the record
+    is flattened with MARCrecordParser (keyed on the 001 control number) or DCrecordParser (keyed on the
+    OAI identifier), with the values of repeated fields as lists. Deleted EDM records are yielded with None
+    as the record, so that CatalogStore.upsert removes them. MARC records without a 001 field and EDM records
+    without an identifier are skipped (as are deleted MARC records, whose 001 is not known).
+    """
+    format = detect_file_format(filepath)
+    if format == "marc":
+        for record in iter_marc_records(filepath):
+            control_numbers = record.get_fields("001")
+            if not control_numbers or not control_numbers[0].data:
+                continue
+            yield control_numbers[0].data.strip(), format, MARCrecordParser(record, multivalue="list").parse()
+    else:
+        oai = "{" + get_namespaces()["oai"] + "}"
+        for record in iter_edm_records(filepath):
+            identifier = record.findtext(oai + "header/" + oai + "identifier")
+            if not identifier:
+                continue
+            if record.find(oai + "header").get("status") == "deleted":
+                yield identifier.strip(), format, None
+            else:
+                yield identifier.strip(), format, DCrecordParser(record, multivalue="list").parse()
+
+
+class CatalogStore():
+    """
+    A local catalog of harvested records in an SQLite database, for indexed queries across collections
+    instead of full scans of the harvested files.
+
+    Each record is stored once per collection, keyed on the collection key and its MARC 001 control number
+    or OAI identifier, with the typed columns of `catalog_columns` and the whole flattened record as JSON.
+    The title, creator, contributor and subject columns are indexed for full-text search (SQLite FTS5), and
+    the ISBN, ISSN and UDC values are indexed for exact lookups. Ingesting a record again replaces it and
+    ingesting a deleted record removes it, so that repeated harvests can be loaded incrementally.
+
+    Args:
+        path (str): The path of the database file (created if it does not exist), or ":memory:".
+
+    Attributes:
+        path (str): The path of the database file.
+        connection (sqlite3.Connection): The database connection, for custom queries.
+
+    Methods:
+        upsert(records, collection):
+            Inserts, replaces or deletes (identifier, format, record) tuples.
+
+        ingest(filepath, collection):
+            Loads a harvested OAI-PMH file.
+
+        search(query, limit):
+            Full-text search on the title, creator, contributor and subject columns.
+
+        lookup(scheme, value):
+            Finds the records with an ISBN, ISSN or UDC value.
+
+        get(identifier, collection):
+            Returns a stored record.
+
+    Example:
+        >>> with CatalogStore("data/catalog.db") as catalog:
+        ...     catalog.ingest("data/erb_books.xml")
+        ...     catalog.search("tammsaare AND subject:romaanid")
+        ...     catalog.lookup("isbn", "9985-2-0001-X")
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def create_tables(self):
+        columns = ",\n".join(f"{column} {sql_type}" for column, (sql_type, _, _) in catalog_columns.items())
+        fts = ", ".join(fts_columns)
+        new_fts = ", ".join(f"new.{column}" for column in fts_columns)
+        old_fts = ", ".join(f"old.{column}" for column in fts_columns)
+        self.connection.executescript(f"""
+            CREATE TABLE IF NOT EXISTS records (
+                rowid INTEGER PRIMARY KEY,
+                id TEXT NOT NULL,
+                collection TEXT NOT NULL,
+                format TEXT,
+                {columns},
+                data TEXT,
+                UNIQUE (collection, id)
+            );
+            CREATE INDEX IF NOT EXISTS records_id ON records (id);
+            CREATE INDEX IF NOT EXISTS records_year ON records (year);
+
+            CREATE TABLE IF NOT EXISTS identifiers (
+                collection TEXT NOT NULL,
+                record_id TEXT NOT NULL,
+                scheme TEXT NOT NULL,
+                value TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS identifiers_value ON identifiers (scheme, value);
+            CREATE INDEX IF NOT EXISTS identifiers_record ON identifiers (collection, record_id);
+
+            CREATE VIRTUAL TABLE IF NOT EXISTS records_fts USING fts5 (
+                {fts}, content='records', content_rowid='rowid'
+            );
+            CREATE TRIGGER IF NOT EXISTS records_ai AFTER INSERT ON records BEGIN
+                INSERT INTO records_fts (rowid, {fts}) VALUES (new.rowid, {new_fts});
+            END;
+            CREATE TRIGGER IF NOT EXISTS records_ad AFTER DELETE ON records BEGIN
+                INSERT INTO records_fts (records_fts, rowid, {fts}) VALUES ('delete', old.rowid, {old_fts});
+            END;
+            CREATE TRIGGER IF NOT EXISTS records_au AFTER UPDATE ON records BEGIN
+                INSERT INTO records_fts (records_fts, rowid, {fts}) VALUES ('delete', old.rowid, {old_fts});
+                INSERT INTO records_fts (rowid, {fts}) VALUES (new.rowid, {new_fts});
+            END;
+        """)
+
+    def upsert(self, records, collection: str=None, batch_size: int=1000) -> int:
+        """
+        Inserts the (identifier, format, record) tuples (as yielded by iter_catalog_records) into a collection
+        (stored as "" if None), replacing the stored records with the same identifier in the collection, and
+        deletes the records whose record is None. Tuples without an identifier are skipped, and of the tuples
+        with the same identifier, the last one wins. The records are written in transactions of `batch_size`.
+        Returns the number of records written or deleted.
+        """
+        collection = collection if collection is not None else ""
+        names = ["id", "collection", "format"] + list(catalog_columns.keys()) + ["data"]
+        updates = ", ".join(f"{name} = excluded.{name}" for name in names[1:])
+        insert_record = (f"INSERT INTO records ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+                         f"ON CONFLICT (collection, id) DO UPDATE SET {updates}")
+        n_records = 0
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                n_records += self.write_batch(batch, collection, insert_record)
+                batch = []
+        if batch:
+            n_records += self.write_batch(batch, collection, insert_record)
+        return n_records
+
+    def write_batch(self, batch: list, collection: str, insert_record: str) -> int:
+        # a repeated identifier would insert its identifiers twice; the last version wins, as in separate batches
+        latest = {}
+        for identifier, format, record in batch:
+            if identifier:
+                latest[identifier] = (format, record)
+        rows = []
+        deleted = []
+        identifiers = []
+        for identifier, (format, record) in latest.items():
+            if record is None:
+                deleted.append((collection, identifier))
+                continue
+            row = catalog_row(record, format)
+            rows.append([identifier, collection, format] + list(row.values())
+                        + [json.dumps(record, ensure_ascii=False)])
+            for scheme in identifier_schemes:
+                values = {normalize_identifier(scheme, value) for value in column_values(record, format, scheme)}
+                identifiers += [(collection, identifier, scheme, value) for value in values if value]
+        with self.connection:
+            self.connection.executemany("DELETE FROM records WHERE collection = ? AND id = ?", deleted)
+            self.connection.executemany(insert_record, rows)
+            self.connection.executemany("DELETE FROM identifiers WHERE collection = ? AND record_id = ?",
+                                        [(collection, identifier) for identifier in latest])
+            self.connection.executemany("INSERT INTO identifiers VALUES (?, ?, ?, ?)", identifiers)
+        return len(latest)
+
+    def ingest(self, filepath: str, collection: str=None) -> int:
+        """
+        Loads the records of a harvested OAI-PMH file into the catalog, streaming over the file.
+        The collection key defaults to the file name without the .xml extension.
+        """
+        if collection is None:
+            collection = os.path.splitext(os.path.basename(filepath))[0]
+        n_records = self.upsert(iter_catalog_records(filepath), collection=collection)
+        print(f"Loaded {n_records} records of {collection} into {self.path}")
+        return n_records
+
+    def search(self, query: str, limit: int=20) -> list:
+        """
+        Full-text search with the SQLite FTS5 query syntax (e.g. "tammsaare", "creator:tammsaare",
+        "tõde AND õigus", "eesti*"). Returns the best matching records as dictionaries.
+        """
+        rows = self.connection.execute("SELECT records.* FROM records_fts JOIN records ON records.rowid = records_fts.rowid "
+                                       "WHERE records_fts MATCH ? ORDER BY rank LIMIT ?", (query, limit))
+        return [dict(row) for row in rows]
+
+    def lookup(self, scheme: str, value: str) -> list:
+        """Returns the records with the given ISBN, ISSN or UDC value."""
+        if scheme not in identifier_schemes:
+            raise ValueError(f"Unknown identifier scheme: {scheme}. Must be one of {identifier_schemes}.")
+        rows = self.connection.execute("SELECT records.* FROM identifiers JOIN records "
+                                       "ON records.collection = identifiers.collection AND records.id = identifiers.record_id "
+                                       "WHERE identifiers.scheme = ? AND identifiers.value = ?",
+                                       (scheme, normalize_identifier(scheme, value)))
+        return [dict(row) for row in rows]
+
+    def get(self, identifier: str, collection: str=None) -> dict:
+        """
+        Returns the stored record with the given identifier, with the flattened record in "data", or None.
+        As the same identifier may occur in several collections, give the `collection` to choose between
+        them; otherwise the first stored record is returned.
+        """
+        if collection is None:
+            row = self.connection.execute("SELECT * FROM records WHERE id = ? ORDER BY rowid", (identifier,)).fetchone()
+        else:
+            row = self.connection.execute("SELECT * FROM records WHERE collection = ? AND id = ?",
+                                          (collection, identifier)).fetchone()
+        if row is None:
+            return None
+        row = dict(row)
+        row["data"] = json.loads(row["data"])
+        return row
+
+    def count(self, collection: str=None) -> int:
+        if collection is None:
+            return self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+        return self.connection.execute("SELECT COUNT(*) FROM records WHERE collection = ?", (collection,)).fetchone()[0]
@@ -0,0 +1,251 @@
+"""
+Command-line entry point for harvesting and converting the RaRa metadata collections.
+
+Usage:
+    python cli.py list
+    python cli.py harvest erb_books nle_books --outdir data
+    python cli.py harvest erb_books --stream parquet --archive
+    python cli.py harvest --all --split-sets
+    python cli.py harvest erb --shard-records 50000
+    python cli.py convert data/erb_books.xml --outdir data/converted
+    python cli.py dataset data/*.xml --outdir data/dataset
+    python cli.py catalog data/*.xml --db data/catalog.db
+    python cli.py catalog --db data/catalog.db --search "creator:tammsaare"
+    python cli.py index data/erb_books.xml
+    python cli.py stats data/erb_books.xml
+
+The harvester and converter modules (and with them requests, tqdm, lxml, pymarc and pandas)
+are only imported inside the subcommands that need them, so that cheap commands start quickly.
+"""
+import argparse
+import os
+import sys
+
+from oai_collections import collections
+
+
+def output_path(filepath: str, outdir: str, extension: str) -> str:
+    fname = os.path.splitext(os.path.basename(filepath))[0]
+    return os.path.join(outdir, fname + extension)
+
+
+def list_collections(args):
+    for key, collection in collections.items():
+        print(f"{key}\t{collection['title']}\t{collection['original_format']}")
+
+
+def harvest(args):
+    from harvester import harvest_oai, harvest_superset, group_subsets
+    from rate_control import RateController
+
+    keys = list(collections.keys())[args.start:] if args.all else args.keys
+    unknown = [key for key in keys if key not in collections]
+    if unknown:
+        raise SystemExit(f"Unknown collection key(s): {', '.join(unknown)}. See `python cli.py list`.")
+    os.makedirs(args.outdir, exist_ok=True)
+    groups = group_subsets(keys) if args.split_sets else {key: [] for key in keys}
+    for key, subsets in groups.items():
+        print(f"Collecting {collections[key]['title']}")
+        controller = RateController(max_concurrency=args.max_concurrency)
+        if subsets:
+            counts = harvest_superset(key, args.outdir, subsets=subsets, controller=controller)
+            print(", ".join(f"{name}: {n_records}" for name, n_records in counts.items()))
+        elif args.stream:
+            from pipeline import stream_collection, JSONLSink, ParquetSink, CatalogSink
+
+            if args.stream == "parquet":
+                sink = ParquetSink(os.path.join(args.outdir, f"{key}.parquet"), collection=key,
+                                   multivalue=args.multivalue)
+            elif args.stream == "jsonl":
+                sink = JSONLSink(os.path.join(args.outdir, f"{key}.jsonl"))
+            else:
+                sink = CatalogSink(args.db, collection=key)
+            counts = stream_collection(key, sink,
+                                       archive_path=os.path.join(args.outdir, f"{key}.xml") if args.archive else None,
+                                       controller=controller,
+                                       multivalue=args.multivalue,
+                                       control_fields=args.stream == "parquet")
+            print(f"Converted {counts['written']} records")
+        else:
+            harvest_oai(key=key,
+                        savepath=os.path.join(args.outdir, f"{key}.xml"),
+                        controller=controller,
+                        shard_records=args.shard_records,
+                        shard_bytes=args.shard_bytes)
+        metrics = controller.metrics()
+        print(f"{metrics['successes']} requests, {metrics['throttled']} throttled, {metrics['errors']} errors, "
+              f"final concurrency {metrics['concurrency']}")
+
+
+def convert(args):
+    from converter import oai_to_dataframe, oai_to_json
+
+    fields = args.fields.split(",") if args.fields else None
+    os.makedirs(args.outdir, exist_ok=True)
+    for filepath in args.files:
+        print(f"Converting {os.path.basename(filepath)}")
+        if args.format == "json":
+            oai_to_json(filepath=filepath,
+                        json_output_path=output_path(filepath, args.outdir, ".json"),
+                        fields=fields,
+                        full_edm=args.full_edm)
+        else:
+            df = oai_to_dataframe(filepath=filepath,
+                                  marc_threshold=args.threshold,
+                                  replace_columns=not args.keep_codes,
+                                  vectorized=args.vectorized,
+                                  fields=fields,
+                                  full_edm=args.full_edm)
+            df.to_csv(output_path(filepath, args.outdir, ".tsv"),
+                      sep="\t", encoding="utf8", index=False)
+
+
+def dataset(args):
+    from dataset import write_parquet_dataset
+
+    write_parquet_dataset(args.files, args.outdir,
+                          partition_by=args.partition_by.split(","),
+                          multivalue=args.multivalue)
+
+
+def catalog(args):
+    from catalog import CatalogStore
+
+    with CatalogStore(args.db) as store:
+        for filepath in args.files:
+            store.ingest(filepath)
+        if args.search:
+            for record in store.search(args.search, limit=args.limit):
+                print(f"{record['id']}\t{record['collection']}\t{record['creator'] or ''}\t{record['title'] or ''}\t{record['year'] or ''}")
+
+
+def index(args):
+    from converter import read_oai_headers, read_oai_header
+
+    for filepath in args.files:
+        savepath = args.output or output_path(filepath, os.path.dirname(filepath), ".index.tsv")
+        n_records = 0
+        with open(savepath, "w", encoding="utf8") as f:
+            if args.offsets:
+                from scanner import RecordScanner
+
+                f.write("identifier\tdatestamp\tsetSpec\tdeleted\toffset\tlength\n")
+                with RecordScanner(filepath) as scanner:
+                    # the header and the offsets of each record come from the same slice of the file
+                    for i in range(len(scanner)):
+                        header = read_oai_header(scanner.parse(i))
+                        if header is None:
+                            continue
+                        start, end = scanner.starts[i], scanner.ends[i]
+                        f.write(f"{header['identifier']}\t{header['datestamp']}\t{header['setSpec']}\t{header['deleted']}\t{start}\t{end - start}\n")
+                        n_records += 1
+            else:
+                f.write("identifier\tdatestamp\tsetSpec\tdeleted\n")
+                for header in read_oai_headers(filepath):
+                    f.write(f"{header['identifier']}\t{header['datestamp']}\t{header['setSpec']}\t{header['deleted']}\n")
+                    n_records += 1
+        print(f"Indexed {n_records} records of {os.path.basename(filepath)} to {savepath}")
+
+
+def stats(args):
+    from profiling import profile
+
+    for filepath in args.files:
+        stats = profile(filepath, top_k=args.top)
+        print(f"{os.path.basename(filepath)}: {stats['records']} records ({stats['deleted']} deleted), "
+              f"{len(stats['fields'])} fields, years {stats['years'][0]}-{stats['years'][1]}, "
+              f"datestamps {stats['datestamps'][0]} - {stats['datestamps'][1]}")
+        print("field\tpopulation\tvalues\tdistinct\ttop values")
+        for path, field in stats["fields"].items():
+            top = "; ".join(f"{value} ({count})" for value, count in field["top"])
+            print(f"{path if args.keep_codes else field['name']}\t{field['population']:.3f}\t{field['values']}\t~{field['distinct']}\t{top}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="rara-metadata",
+                                     description="Harvest and convert the metadata collections of the National Library of Estonia.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("list", help="list the available collections")
+    p.set_defaults(func=list_collections)
+
+    p = subparsers.add_parser("harvest", help="harvest collections from the OAI-PMH endpoint")
+    p.add_argument("keys", nargs="*", help="collection keys (see `list`)")
+    p.add_argument("--all", action="store_true", help="harvest all collections")
+    p.add_argument("--start", type=int, default=0, help="with --all, skip the first N collections")
+    p.add_argument("--outdir", default="data", help="directory for the harvested XML files (default: data)")
+    p.add_argument("--max-concurrency", type=int, default=4, help="the most requests in flight at a time (default: 4)")
+    p.add_argument("--stream", choices=["parquet", "jsonl", "catalog"],
+                   help="convert the records while harvesting, instead of writing the XML file")
+    p.add_argument("--archive", action="store_true", help="with --stream, also write the harvested XML file")
+    p.add_argument("--db", default=os.path.join("data", "catalog.db"), help="with --stream catalog, the catalog database (default: data/catalog.db)")
+    p.add_argument("--multivalue", choices=["join", "list"], default="join",
+                   help='with --stream, join repeated values with "; " or keep them as lists (default: join)')
+    p.add_argument("--split-sets", action="store_true",
+                   help="harvest a collection once together with its subsets (e.g. erb and erb_books), "
+                        "and write the subsets from it (not with --stream)")
+    p.add_argument("--shard-records", type=int,
+                   help="write numbered shards of at most N records and a manifest, instead of one XML file")
+    p.add_argument("--shard-bytes", type=int,
+                   help="write numbered shards of about N bytes and a manifest, instead of one XML file")
+    p.set_defaults(func=harvest)
+
+    p = subparsers.add_parser("convert", help="convert harvested XML files to TSV or JSON")
+    p.add_argument("files", nargs="+", help="harvested OAI-PMH XML files")
+    p.add_argument("--outdir", default=os.path.join("data", "converted"), help="output directory (default: data/converted)")
+    p.add_argument("--format", choices=["tsv", "json"], default="tsv")
+    p.add_argument("--threshold", type=float, default=0.1, help="MARC column population threshold (default: 0.1)")
+    p.add_argument("--keep-codes", action="store_true", help="keep the MARC field codes as column names")
+    p.add_argument("--vectorized", action="store_true", help="clean each distinct MARC value once and build the columns with numpy")
+    p.add_argument("--fields", help="comma-separated fields to extract, e.g. title,creator,260$c (default: all)")
+    p.add_argument("--full-edm", action="store_true",
+                   help="for EDM files, extract all EDM properties (aggregation, web resources etc.), not only Dublin Core")
+    p.set_defaults(func=convert)
+
+    p = subparsers.add_parser("dataset", help="convert harvested XML files into one partitioned Parquet dataset")
+    p.add_argument("files", nargs="+", help="harvested OAI-PMH XML files (the file names are used as collection keys)")
+    p.add_argument("--outdir", default=os.path.join("data", "dataset"), help="dataset directory (default: data/dataset)")
+    p.add_argument("--partition-by", default="collection,decade,language_code",
+                   help="comma-separated partition columns (default: collection,decade,language_code)")
+    p.add_argument("--multivalue", choices=["join", "list"], default="join",
+                   help='join repeated values with "; " or store them as list columns (default: join)')
+    p.set_defaults(func=dataset)
+
+    p = subparsers.add_parser("catalog", help="load harvested XML files into a searchable SQLite catalog, or search it")
+    p.add_argument("files", nargs="*", help="harvested OAI-PMH XML files to load (the file names are used as collection keys)")
+    p.add_argument("--db", default=os.path.join("data", "catalog.db"), help="catalog database (default: data/catalog.db)")
+    p.add_argument("--search", help='full-text query on titles, persons and subjects, e.g. "creator:tammsaare"')
+    p.add_argument("--limit", type=int, default=20, help="maximum number of search results (default: 20)")
+    p.set_defaults(func=catalog)
+
+    p = subparsers.add_parser("index", help="write the OAI header index (identifiers, datestamps, sets) of harvested files")
+    p.add_argument("files", nargs="+", help="harvested OAI-PMH XML files")
+    p.add_argument("--output", help="output TSV path (default: next to the input file, *.index.tsv)")
+    p.add_argument("--offsets", action="store_true", help="add the byte offset and length of each record in the file")
+    p.set_defaults(func=index)
+
+    p = subparsers.add_parser("stats", help="print record counts, field population rates, distinct counts, "
+                                            "common values and date ranges of harvested files")
+    p.add_argument("files", nargs="+", help="harvested OAI-PMH XML files")
+    p.add_argument("--keep-codes", action="store_true", help="report MARC field codes instead of column names")
+    p.add_argument("--top", type=int, default=3, help="the number of most common values shown per field (default: 3)")
+    p.set_defaults(func=stats)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "harvest" and not args.all and not args.keys:
+        raise SystemExit("Provide one or more collection keys, or --all.")
+    if args.command == "harvest" and args.split_sets and args.stream:
+        raise SystemExit("--split-sets writes XML files and cannot be used with --stream.")
+    if args.command == "harvest" and (args.shard_records or args.shard_bytes) and (args.stream or args.split_sets):
+        raise SystemExit("--shard-records and --shard-bytes cannot be used with --stream or --split-sets.")
+    if args.command == "index" and args.output and len(args.files) > 1:
+        raise SystemExit("--output can only be used with a single input file.")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
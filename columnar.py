@@ -0,0 +1,98 @@
+import numpy as np
+
+
+backends = ["pandas", "arrow", "polars"]
+
+
+def import_backend(backend: str):
+    """
+    Imports and returns the optional library of a DataFrame backend ("arrow" or "polars"),
+    with an informative error if it is not installed.
+    """
+    package = {"arrow": "pyarrow", "polars": "polars"}[backend]
+    try:
+        if backend == "arrow":
+            import pyarrow
+            return pyarrow
+        else:
+            import polars
+            return polars
+    except ImportError:
+        raise ImportError(f'backend="{backend}" requires the {package} package: pip install {package}')
+
+
+class ColumnBuffers():
+    """
+    Accumulates parsed records column by column, as an alternative to building a list of row dictionaries.
+
+    Each column keeps only the row numbers and values of its non-empty cells, so that wide and sparse
+    collections stay small until the final table is built.
+
+    Attributes:
+        n_rows (int): The number of records appended so far.
+        columns (dict): The buffers of the columns, as {column: (row_numbers, values)}, in the order in
+            which the columns were first seen.
+
+    Methods:
+        append(record):
+            Appends a parsed record (a flat dictionary).
+
+        population():
+            Returns the share of records in which each column is populated.
+
+        to_arrow(threshold, columns_dict):
+            Builds a pyarrow.Table.
+
+        to_polars(threshold, columns_dict):
+            Builds a polars.DataFrame.
+    """
+
+    def __init__(self):
+        self.n_rows = 0
+        self.columns = {}
+
+    def append(self, record: dict):
+        row = self.n_rows
+        for key, value in record.items():
+            column = self.columns.get(key)
+            if column is None:
+                column = self.columns[key] = ([], [])
+            column[0].append(row)
+            column[1].append(value)
+        self.n_rows += 1
+
+    def population(self) -> dict:
+        return {key: len(rows) / self.n_rows for key, (rows, _) in self.columns.items()}
+
+    def select_columns(self, threshold: float=0, columns_dict: dict=None) -> dict:
+        """
+        Returns the columns that are populated in more than `threshold` of the records, as {output_name: column},
+        renamed with `columns_dict` if given. Unlike pandas, Arrow and Polars need unique column names,
+        so a column whose new name is already taken keeps its original name.
+        """
+        selected = {}
+        for key, population in self.population().items():
+            if population > threshold:
+                name = columns_dict.get(key, key) if columns_dict is not None else key
+                if name in selected:
+                    name = key
+                selected[name] = key
+        return selected
+
+    def dense(self, key: str) -> np.ndarray:
+        rows, values = self.columns[key]
+        column = np.full(self.n_rows, None, dtype=object)
+        column[rows] = values
+        return column
+
+    def to_arrow(self, threshold: float=0, columns_dict: dict=None):
+        pa = import_backend("arrow")
+        selected = self.select_columns(threshold, columns_dict)
+        arrays = [pa.array(self.dense(key), from_pandas=True) for key in selected.values()]
+        return pa.Table.from_arrays(arrays, names=list(selected.keys()))
+
+    def to_polars(self, threshold: float=0, columns_dict: dict=None):
+        pl = import_backend("polars")
+        selected = self.select_columns(threshold, columns_dict)
+        return pl.DataFrame([pl.Series(name, self.dense(key).tolist()) for name, key in selected.items()],
+                            height=self.n_rows)
@@ -0,0 +1,168 @@
+import sys
+from collections.abc import Mapping
+
+
+class Layout():
+    """
+    The field layout of a record, shared by all records with the same paths in the same order.
+
+    Attributes:
+        paths (tuple): The (interned) field path of each slot, e.g. "245$a".
+        occurrences (tuple): The field occurrence of each slot: the position of its field among the fields
+            with the same tag, e.g. 0 for the subfields of the first 650 field and 1 for those of the second.
+        index (dict): The slots of each path, in their original order.
+    """
+    __slots__ = ("paths", "occurrences", "index")
+
+    def __init__(self, paths: tuple, occurrences: tuple):
+        self.paths = paths
+        self.occurrences = occurrences
+        index = {}
+        for slot, path in enumerate(paths):
+            index.setdefault(path, []).append(slot)
+        self.index = {path: tuple(slots) for path, slots in index.items()}
+
+
+class Interner():
+    """
+    Deduplicates the strings and record layouts shared by many records of a collection.
+
+    Field paths and short values (language codes, agency names, thesaurus codes etc.) are interned,
+    so that every record refers to the same string object. Records with identical field layouts
+    share a single Layout, with its index from the paths to the values.
+
+    Args:
+        max_value_length (int): Values up to this length are interned; longer values (titles, notes)
+            are rarely repeated and are stored as they are.
+    """
+
+    def __init__(self, max_value_length: int=64):
+        self.max_value_length = max_value_length
+        self.layouts = {}
+
+    def path(self, path: str) -> str:
+        return sys.intern(path)
+
+    def value(self, value):
+        if type(value) == str and len(value) <= self.max_value_length:
+            return sys.intern(value)
+        return value
+
+    def layout(self, paths: tuple, occurrences: tuple) -> Layout:
+        layout = self.layouts.get((paths, occurrences))
+        if layout is None:
+            layout = Layout(tuple(self.path(path) for path in paths), occurrences)
+            self.layouts[(layout.paths, layout.occurrences)] = layout
+        return layout
+
+
+class CompactRecord(Mapping):
+    """
+    A read-only, memory-efficient record with a dict-like API.
+
+    The record is stored as a tuple of (interned) values, in the order of the original record, and a Layout
+    shared with the records of the same shape, which holds the field path and the field occurrence of each
+    value and an index from the paths to the values. A path may occur more than once, e.g. for repeated
+    MARC fields or the values of a repeated EDM field, so reading a path always returns a tuple of all of its values. The subfields of each
+    occurrence of a MARC field are returned together by `fields`.
+
+    Examples:
+    ---------
+    >>> record["245$a"]
+    ('Tõde ja õigus',)
+    >>> record.get("650$a")
+    ('ajalugu', 'kirjandus')
+    >>> record.fields("650")
+    [{'650$a': ('ajalugu',), '650$y': ('19. saj',)}, {'650$a': ('kirjandus',)}]
+    >>> dict(record)  # or record.to_dict()
+    """
+    __slots__ = ("_layout", "_values")
+
+    def __init__(self, layout: Layout, values: tuple):
+        self._layout = layout
+        self._values = values
+
+    @classmethod
+    def from_dict(cls, record: dict, interner: Interner):
+        """
+        Builds a compact record from a flat dictionary, e.g. the output of DCrecordParser.parse() with
+        multivalue="list". Each value of a list is stored in its own slot under the same path, as the n-th
+        occurrence of the path, so that record["creator"] returns ("Autor", "Teine") rather than one joined string.
+        """
+        paths = []
+        occurrences = []
+        values = []
+        for path, value in record.items():
+            for occurrence, item in enumerate(value if type(value) == list else [value]):
+                paths.append(path)
+                occurrences.append(occurrence)
+                values.append(interner.value(item))
+        return cls(interner.layout(tuple(paths), tuple(occurrences)), tuple(values))
+
+    @classmethod
+    def from_marc(cls, record, interner: Interner):
+        """
+        Builds a compact record from a pymarc Record. The leader is stored under "leader", control fields
+        under their tag (e.g. "001"), subfields under "tag$code" (e.g. "245$a") and non-blank indicators
+        under "tag$ind1" and "tag$ind2", each with the occurrence of its field among the fields with the same tag.
+        """
+        paths = ["leader"]
+        occurrences = [0]
+        values = [interner.value(record.leader)]
+        seen = {}
+        for field in record.fields:
+            occurrence = seen.get(field.tag, 0)
+            seen[field.tag] = occurrence + 1
+            if field.is_control_field():
+                paths.append(field.tag)
+                occurrences.append(occurrence)
+                values.append(interner.value(field.data))
+            else:
+                for name, indicator in zip(("ind1", "ind2"), field.indicators):
+                    if indicator not in (" ", None):
+                        paths.append(field.tag + "$" + name)
+                        occurrences.append(occurrence)
+                        values.append(interner.value(indicator))
+                subfields = field.subfields
+                for i in range(0, len(subfields) - 1, 2):
+                    paths.append(field.tag + "$" + subfields[i])
+                    occurrences.append(occurrence)
+                    values.append(interner.value(subfields[i+1]))
+        return cls(interner.layout(tuple(paths), tuple(occurrences)), tuple(values))
+
+    def __getitem__(self, path) -> tuple:
+        slots = self._layout.index.get(path)
+        if slots is None:
+            raise KeyError(path)
+        return tuple(self._values[slot] for slot in slots)
+
+    def fields(self, tag: str) -> list:
+        """
+        Returns the occurrences of a field as a list of dictionaries from the paths of the field to tuples
+        of their values, e.g. [{"650$a": ("ajalugu",), "650$y": ("19. saj",)}, {"650$a": ("kirjandus",)}],
+        or an empty list if the record has no such field.
+        """
+        layout = self._layout
+        occurrences = []
+        for slot, path in enumerate(layout.paths):
+            if path == tag or path.startswith(tag + "$"):
+                occurrence = layout.occurrences[slot]
+                if occurrence == len(occurrences):
+                    occurrences.append({})
+                occurrences[occurrence].setdefault(path, []).append(self._values[slot])
+        return [{path: tuple(values) for path, values in field.items()} for field in occurrences]
+
+    def __iter__(self):
+        return iter(self._layout.index)
+
+    def __len__(self):
+        return len(self._layout.index)
+
+    def __contains__(self, path):
+        return path in self._layout.index
+
+    def __repr__(self):
+        return f"CompactRecord({self.to_dict()!r})"
+
+    def to_dict(self) -> dict:
+        return {path: self[path] for path in self}
@@ -1,47 +1,65 @@
-from pymarc import parse_xml
 from pymarc.record import Record
-from pymarc.marcxml import XmlHandler, MARC_XML_NS
+from pymarc.field import Field
+from pymarc.marcxml import MARC_XML_NS
 from lxml import etree
 import pandas as pd
+import numpy as np
 import json
 import re
+from itertools import repeat
+from functools import lru_cache
 
+from compact import CompactRecord, Interner
+from columnar import ColumnBuffers, backends
 
-class MyContentHandler(XmlHandler):
-    
-    def endElementNS(self, name, qname):
-        """End element NS."""
-        if self._strict and name[0] != MARC_XML_NS:
-            return
 
-        element = name[1]
-        if self.normalize_form is not None:
-            text = unicodedata.normalize(self.normalize_form, "".join(self._text))
+# how the values of repeated fields are returned by the record parsers
+multivalue_modes = ["join", "list"]
+
+year_patterns = [re.compile("(^([\D\s]+)(\d{4})([\D\s]*)$)|(^([\D\s]*)(\d{4})([\D\s]+)$)"),
+                 re.compile("^\d{4}-\d{2}-\d{2}$"),
+                 re.compile("^\d{2}-\d{2}-\d{4}$"),
+                 re.compile("^\d{4}-\d{2}$")]
+
+
+# the dates of a collection repeat a lot, so the years are cached (with a bounded cache)
+@lru_cache(maxsize=65536)
+def extract_year(date: str):
+    """
+    Cleans a datetime string to find a valid year (between 1500 and 2024), or returns None.
+    """
+    if len(date) == 4 and date.isnumeric():
+        if int(date) > 1500 and int(date) < 2024:
+            return int(date)
         else:
-            text = "".join(self._text)
-
-        if element == "record":
-            self.process_record(self._record)
-            self._record = None
-        elif element == "leader":
-            self._record.leader = text
-        elif element == "controlfield":
-            self._field.data = text
-            self._record.add_field(self._field)
-            self._field = None
-        elif element == "datafield":
-            self._record.add_field(self._field)
-            self._field = None
-        elif element == "subfield":
-            # added exception to the parent class to ignore a few coding errors in the RaRa data
-            try:
-                self._field.subfields.append(self._subfield_code)
-                self._field.subfields.append(text)
-                self._subfield_code = None
-            except AttributeError:
-                pass
+            return None
+    for pattern in year_patterns:
+        if re.match(pattern, date):
+            date = re.findall("\d{4}", date)[0]
+    if len(date) == 4:
+        try:
+            date = int(date)
+            if date > 1500 and date < 2024:
+                return date
+        except ValueError:
+            return None
+    else:
+        return None
+
 
-        self._text = []
+def publication_year(dates: list, fixed_data: str=None):
+    """
+    The publication year of a MARC record: the first valid year of its publication `dates` (the 260$c and
+    264$c values, in this order), or else the Date 1 of its 008 field (`fixed_data`, positions 07-10).
+    """
+    for date in dates:
+        if date:
+            year = extract_year(date.strip(" .,;:[]"))
+            if year is not None:
+                return year
+    if fixed_data and len(fixed_data) >= 11:
+        return extract_year(fixed_data[7:11])
+    return None
 
 
 class MARCrecordParser():
@@ -50,10 +68,21 @@ class MARCrecordParser():
 
     Args:
         record (Record): A MARC record.
+        paths (set, optional): If given, only these MARC paths are extracted. A path is either a tag
+            (e.g. "245" for all of its subfields, or "100" for the combined person string) or a subfield (e.g. "245$a").
+        multivalue (str, optional): How the values of repeated fields are returned: "join" (default) joins them
+            into one string with `duplicate_field_sep`, "list" returns the values of all data fields as lists
+            (also when there is only one value), so that values containing the separator stay intact.
+        control_fields (bool, optional): Whether to return the fixed-length control fields 006, 007 and 008
+            (default=False).
 
     Attributes:
-        fields (list): A list of fields in the MARC record.
+        record (Record): The MARC record.
+        paths (set): The MARC paths to extract, or None for all.
+        tags (set): The tags of the paths to extract, or None for all.
+        fields (list): A list of fields in the MARC record (as in `Record.as_dict()`).
         marc_paths (dict): A dictionary of the paths and values of the fields in the MARC record.
+        multivalue (str): "join" or "list".
         duplicate_field_sep (str): A separator for duplicate fields.
         return_control_fields (bool): Whether or not to return control fields.
 
@@ -71,20 +100,32 @@ class MARCrecordParser():
             Simple preprocessing to remove trailing punctuation, etc.
 
         append_field(field, value):
-            Append a field and its value to the marc_paths dictionary.
+            Append a field and its value to the marc_paths dictionary (collecting the values of each path in a list).
 
         sort_marc_paths():
             Sort the marc_paths dictionary.
 
+        finalize_values():
+            Join the collected values of each path, or keep them as lists (see `multivalue`).
+
         parse():
             Parse the fields in the MARC record and return a dictionary of the paths and values of the fields.
     """
 
-    def __init__(self, record: Record):
-        self.fields = record.as_dict()["fields"]
+    def __init__(self, record: Record, paths: set=None, multivalue: str="join", control_fields: bool=False):
+        if multivalue not in multivalue_modes:
+            raise ValueError(f"Unknown multivalue mode: {multivalue}. Must be one of {multivalue_modes}.")
+        self.record = record
+        self.paths = paths
+        self.tags = {path.split("$")[0] for path in paths} if paths is not None else None
         self.marc_paths = {}
+        self.multivalue = multivalue
         self.duplicate_field_sep = "; "
-        self.return_control_fields = False
+        self.return_control_fields = control_fields
+
+    @property
+    def fields(self):
+        return self.record.as_dict()["fields"]
 
     def join_subfields_list(self, subfields_list: list):
         subfields = {}
@@ -149,44 +190,122 @@ class MARCrecordParser():
             except IndexError:
                 pass
             if field not in self.marc_paths.keys():
-                self.marc_paths[field] = value
+                self.marc_paths[field] = [value]
             else:
-                self.marc_paths[field] += self.duplicate_field_sep + value
+                self.marc_paths[field].append(value)
 
     def sort_marc_paths(self):
         sorted_keys = sorted(self.marc_paths.keys(), key=lambda x: int(x.split("$")[0]))
         self.marc_paths = {key: self.marc_paths[key] for key in sorted_keys}
 
-    def parse(self):
-        for field in self.fields:
-            path, value = next(iter(field.items()))
+    def finalize_values(self):
+        for path, values in self.marc_paths.items():
+            # the control fields (001-009) are not repeatable and always stay strings
+            if self.multivalue == "join" or path < "010":
+                self.marc_paths[path] = self.duplicate_field_sep.join(values)
+
+    def iter_raw_fields(self):
+        """
+        Yields the (path, value) pairs of the record in their original order, before any cleaning.
+        The person fields (100, 600, 700) are yielded as (tag, subfields) with the subfields as a dictionary.
+        """
+        for field in self.record.fields:
+            path = field.tag
             if path[0] == "9":
                 pass
+            elif self.return_control_fields == False and path in ["006", "007", "008"]:
+                pass
+            elif self.tags is not None and path not in self.tags:
+                pass
+            elif field.is_control_field():
+                if type(field.data) == str:
+                    yield path, field.data
             else:
-                if type(value) == dict:
-                    subfields = self.join_subfields_list(value["subfields"])
-                    if path in ["100", "600", "700"]:
-                        person_string = self.handle_person_subfields(subfields)
-                        self.append_field(path, person_string)
-                    else:
-                        for key, subval in subfields.items():
-                            subpath = path + "$" + key
-                            self.append_field(subpath, subval)
-                elif type(value) == str:
-                    self.append_field(path, value)
+                # same as join_subfields_list: the first position and the last value of each code
+                subfields = dict(zip(field.subfields[::2], field.subfields[1::2]))
+                if path in ["100", "600", "700"]:
+                    yield path, subfields
+                else:
+                    for key, subval in subfields.items():
+                        subpath = path + "$" + key
+                        if self.paths is None or path in self.paths or subpath in self.paths:
+                            yield subpath, subval
+
+    def parse(self):
+        for path, value in self.iter_raw_fields():
+            if type(value) == dict:
+                value = self.handle_person_subfields(value)
+            self.append_field(path, value)
 
         self.sort_marc_paths()
+        self.finalize_values()
         return self.marc_paths
     
 
+edm_namespaces = {"xsi": "http://www.w3.org/2001/XMLSchema-instance",
+                  "oai": "http://www.openarchives.org/OAI/2.0/",
+                  "marc": "http://www.loc.gov/MARC21/slim",
+                  "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+                  "edm": "http://www.europeana.eu/schemas/edm/",
+                  "dc" : "http://purl.org/dc/elements/1.1/",
+                  "dcterms": "http://purl.org/dc/terms/",
+                  "ore": "http://www.openarchives.org/ore/terms/",
+                  "skos": "http://www.w3.org/2004/02/skos/core#",
+                  "owl": "http://www.w3.org/2002/07/owl#"}
+
+# compiled once and shared by all records
+dc_fields_xpath = etree.XPath("./oai:metadata/rdf:RDF/edm:ProvidedCHO/dc:*", namespaces=edm_namespaces)
+edm_sections_xpath = etree.XPath("./oai:metadata/rdf:RDF/*", namespaces=edm_namespaces)
+
+rdf_about = "{%s}about" % edm_namespaces["rdf"]
+rdf_resource = "{%s}resource" % edm_namespaces["rdf"]
+xml_lang = "{http://www.w3.org/XML/1998/namespace}lang"
+
+
+def identifier_column(identifier: str) -> str:
+    """The output column of a dc:identifier value: ISBN, ESTER or DIGAR link, or other identifier."""
+    if ":isbn:" in identifier:
+        return "isbn"
+    elif "www.ester.ee" in identifier:
+        return "ester_url"
+    elif "www.digar.ee" in identifier:
+        return "digar_url"
+    else:
+        return "other_identifier"
+
+
+def compile_edm_columns(columns_dict: dict) -> dict:
+    """
+    Turns a mapping of EDM paths like "edm:ProvidedCHO/dc:title" or "ore:Aggregation/@rdf:about" to output columns
+    into a lookup table {section tag: {property tag: column}}, with the tags in Clark notation ("{namespace}name").
+    """
+    def clark(name):
+        prefix, local = name.lstrip("@").split(":")
+        return "{%s}%s" % (edm_namespaces[prefix], local)
+
+    lookup = {}
+    for path, column in columns_dict.items():
+        section, prop = path.split("/")
+        lookup.setdefault(clark(section), {})["@" if prop.startswith("@") else clark(prop)] = column
+    return lookup
+
+
 class DCrecordParser():
     """
     A class to parse Dublin Core metadata from an EDM record.
 
+    Args:
+        record (etree._Element): An OAI-PMH record containing EDM metadata.
+        projection (set, optional): If given, only these fields are extracted (e.g. {"title", "isbn", "year"}).
+            Language-tagged values are kept under their base field name (e.g. "title_et" under "title").
+        multivalue (str, optional): "join" (default) joins the values of repeated fields with `sep`,
+            "list" returns the values of all fields (except the year) as lists.
+
     Attributes:
         namespaces (dict): A dictionary containing the XML namespaces used in the EDM record.
         fields (etree.ElementIterable): An iterator containing the Dublin Core fields in the EDM record.
         dc_fields (dict): A dictionary containing the parsed Dublin Core fields from the EDM record.
+        multivalue (str): "join" or "list".
         sep (str): A string used to join multiple field values.
 
     Methods:
@@ -198,43 +317,21 @@ class DCrecordParser():
     """
 
 
-    def __init__(self, record: etree._ElementTree):
-        self.namespaces = {"xsi": "http://www.w3.org/2001/XMLSchema-instance",
-                           "oai": "http://www.openarchives.org/OAI/2.0/",
-                           "marc": "http://www.loc.gov/MARC21/slim",
-                           "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
-                           "edm": "http://www.europeana.eu/schemas/edm/",
-                           "dc" : "http://purl.org/dc/elements/1.1/"}
-        self.fields = record.iterfind("./oai:metadata/rdf:RDF/edm:ProvidedCHO/dc:*",
-                                      namespaces=self.namespaces)
+    def __init__(self, record: etree._ElementTree, projection: set=None, multivalue: str="join"):
+        if multivalue not in multivalue_modes:
+            raise ValueError(f"Unknown multivalue mode: {multivalue}. Must be one of {multivalue_modes}.")
+        self.namespaces = edm_namespaces
+        self.fields = dc_fields_xpath(record)
+        self.projection = projection
         self.dc_fields = {}
+        self.multivalue = multivalue
         self.sep = "; "
 
     def extract_year(self, date):
         """
         Cleans a datetime string to find a valid year.
         """
-        if len(date) == 4 and date.isnumeric():
-            if int(date) > 1500 and int(date) < 2024:
-                return int(date)
-            else:
-                return None
-        patterns = [re.compile("(^([\D\s]+)(\d{4})([\D\s]*)$)|(^([\D\s]*)(\d{4})([\D\s]+)$)"),
-                    re.compile("^\d{4}-\d{2}-\d{2}$"),
-                    re.compile("^\d{2}-\d{2}-\d{4}$"),
-                    re.compile("^\d{4}-\d{2}$")]
-        for pattern in patterns:
-            if re.match(pattern, date):
-                date = re.findall("\d{4}", date)[0]
-        if len(date) == 4:
-            try:
-                date = int(date)
-                if date > 1500 and date < 2024:
-                    return date
-            except ValueError:
-                return None
-        else:
-            return None
+        return extract_year(date)
     
     def parse(self):
         """Converts a single EDM record to a dictionary"""
@@ -246,41 +343,190 @@ class DCrecordParser():
 
                 if text is not None:
                     if tag == "identifier":
-                        if ":isbn:" in text:
-                            tag = "isbn"
-                        elif "www.ester.ee" in text:
-                            tag = "ester_url"
-                        elif "www.digar.ee" in text:
-                            tag = "digar_url"
-                        else:
-                            tag = "other_identifier"
-
-                    if tag == "date":
-                        self.dc_fields["year"] = self.extract_year(text)        
+                        tag = identifier_column(text)
+
+                    if tag == "date" and (self.projection is None or "year" in self.projection):
+                        self.dc_fields["year"] = self.extract_year(text)
+                    if self.projection is not None and tag not in self.projection:
+                        continue
                     if lang is not None:
                         tag = tag + "_" + lang 
                     if tag in self.dc_fields.keys():
-                        self.dc_fields[tag] += self.sep + text
+                        self.dc_fields[tag].append(text)
                     else:
-                        self.dc_fields[tag] = text
+                        self.dc_fields[tag] = [text]
 
+        if self.multivalue == "join":
+            for tag, values in self.dc_fields.items():
+                if tag != "year":
+                    self.dc_fields[tag] = self.sep.join(values)
         return self.dc_fields
     
 
+class EDMrecordParser():
+    """
+    A class to extract the full set of useful EDM properties from an EDM record: the ProvidedCHO (Dublin Core
+    and DC terms properties, edm:type etc.), the ore:Aggregation (data provider, links to the object and the
+    landing page, rights statement), the edm:WebResources and the labels of the contextual entities.
+
+    The properties and their output columns are listed in `edm_columns_dict`. Each record is walked once:
+    a compiled XPath expression shared by all records finds the top-level resources of the record, and their
+    properties are looked up in a table. Properties without text (e.g. edm:isShownAt) give their rdf:resource.
+    The ProvidedCHO columns are the same as those of DCrecordParser, including the classified identifiers,
+    the year and the language-tagged variants.
+
+    Args:
+        record (etree._Element): An OAI-PMH record containing EDM metadata.
+        projection (set, optional): If given, only these columns are extracted (e.g. {"title", "is_shown_by"}).
+        multivalue (str, optional): "join" (default) or "list", as in DCrecordParser.
+
+    Attributes:
+        edm_fields (dict): The extracted properties.
+        sep (str): A string used to join multiple values.
+
+    Methods:
+        parse():
+            Extracts the properties of the EDM record and returns them as a dictionary.
+    """
+
+    def __init__(self, record: etree._Element, projection: set=None, multivalue: str="join"):
+        if multivalue not in multivalue_modes:
+            raise ValueError(f"Unknown multivalue mode: {multivalue}. Must be one of {multivalue_modes}.")
+        self.record = record
+        self.projection = projection
+        self.multivalue = multivalue
+        self.edm_fields = {}
+        self.sep = "; "
+
+    def add_value(self, column: str, value: str, lang: str=None):
+        if self.projection is not None and column not in self.projection:
+            return
+        if lang is not None:
+            column = column + "_" + lang
+        if column in self.edm_fields:
+            self.edm_fields[column].append(value)
+        else:
+            self.edm_fields[column] = [value]
+
+    def parse(self):
+        year_needed = self.projection is None or "year" in self.projection
+        for section in edm_sections_xpath(self.record):
+            columns = edm_lookup.get(section.tag)
+            if columns is None:
+                continue
+            if "@" in columns and section.get(rdf_about) is not None:
+                self.add_value(columns["@"], section.get(rdf_about))
+            for prop in section:
+                column = columns.get(prop.tag)
+                if column is None:
+                    continue
+                value = prop.text if prop.text is not None else prop.get(rdf_resource)
+                if value is None:
+                    continue
+                if column == "identifier":
+                    column = identifier_column(value)
+                elif column == "date" and year_needed:
+                    self.edm_fields["year"] = extract_year(value)
+                self.add_value(column, value, prop.get(xml_lang))
+
+        if self.multivalue == "join":
+            for column, values in self.edm_fields.items():
+                if column != "year":
+                    self.edm_fields[column] = self.sep.join(values)
+        return self.edm_fields
+
+
 def register_namespaces():
     for key, value in get_namespaces().items():
         etree.register_namespace(key, value)
 
 
-def read_marc_records(filepath):
+def marc_record_from_element(element: etree._Element, tags: set=None) -> Record:
+    """
+    Builds a pymarc Record from a parsed MARCXML record element, in the same way as the SAX reader of pymarc.
+    If a set of `tags` is given, all other control and data fields are skipped.
+    """
+    marc = "{" + MARC_XML_NS + "}"
+    record = Record()
+    for child in element:
+        if child.tag == marc + "leader":
+            record.leader = child.text or ""
+        elif child.tag == marc + "controlfield":
+            tag = child.get("tag")
+            if tags is None or tag in tags:
+                field = Field(tag)
+                field.data = child.text or ""
+                record.add_field(field)
+        elif child.tag == marc + "datafield":
+            tag = child.get("tag")
+            if tags is None or tag in tags:
+                field = Field(tag, [child.get("ind1", " "), child.get("ind2", " ")])
+                # only the subfields of data fields are read, so that the stray subfields which
+                # the SAX reader skipped (the coding errors in the RaRa data) are skipped here too
+                for subfield in child.iterchildren(marc + "subfield"):
+                    field.subfields.append(subfield.get("code"))
+                    field.subfields.append(subfield.text or "")
+                record.add_field(field)
+    return record
+
+
+def free_element(element: etree._Element):
+    """
+    Frees a finished element of an iterparse() and everything before it: clears the element and deletes
+    the earlier siblings of the element and of its ancestors. Nodes without a parent (the root element,
+    and comments or processing instructions before it) are left alone.
+    """
+    element.clear()
+    for node in [element, *element.iterancestors()]:
+        parent = node.getparent()
+        if parent is None:
+            continue
+        while node.getprevious() is not None:
+            del parent[0]
+
+
+def iter_marc_records(filepath: str, tags: set=None):
+    """
+    Streams over a MARCXML or OAI-PMH MARC21XML file and yields the records as pymarc Records,
+    without building the tree of the whole file.
+
+    Args:
+        filepath (str): The path to the XML file.
+        tags (set, optional): If given, only these MARC fields are read; all others are skipped.
+
+    Yields:
+        pymarc.record.Record: The MARC records. A deleted OAI-PMH record (without a MARC record) is yielded
+            as an empty Record, as the SAX reader of pymarc does, so that every OAI record gives one record.
+    """
+    marc_record = "{" + MARC_XML_NS + "}record"
+    oai_record = "{" + get_namespaces()["oai"] + "}record"
+    for _, element in etree.iterparse(filepath, events=("end",), tag=[marc_record, oai_record]):
+        if element.tag == marc_record:
+            yield marc_record_from_element(element, tags=tags)
+        elif element.find(".//" + marc_record) is None:
+            yield Record()
+        free_element(element)
+
+
+def read_marc_records(filepath, transform=None, tags=None):
+    """
+    Reads the records of a MARCXML or OAI-PMH MARC21XML file as a list of pymarc Records.
+
+    Args:
+        filepath (str): The path to the XML file.
+        transform (callable, optional): A function applied to each record as soon as it is read, so that the
+            full records do not need to be kept in memory. Records for which it returns None are not kept.
+        tags (set, optional): If given, only these MARC fields are read; all others are skipped.
+    """
     if filepath[-4:] != ".xml":
         raise ValueError("Filepath must be in XML format")
     else:
-        handler = MyContentHandler()
-        with open(filepath, "r", encoding="utf8") as f:
-            parse_xml(f, handler=handler)
-        marc_records = handler.records
-        marc_records = [record for record in marc_records if record is not None]
+        marc_records = []
+        for record in iter_marc_records(filepath, tags=tags):
+            if transform is not None:
+                record = transform(record)
+            if record is not None:
+                marc_records.append(record)
         return marc_records
     
 
@@ -305,8 +551,140 @@ def read_edm_records(source):
     return records
 
 
-def marc_to_dataframe(records, columns_dict, threshold, replace_columns):
-    df = pd.DataFrame.from_records((MARCrecordParser(record).parse() for record in records))
+def iter_edm_records(filepath: str, where=None):
+    """
+    Streams over an OAI-PMH XML file with EDM metadata and yields the record elements one by one,
+    without building the tree of the whole file. Each record is freed once the next one is requested.
+
+    Args:
+        filepath (str): The path to the OAI-PMH XML file.
+        where (callable, optional): A predicate on the record element; records for which it returns False are skipped.
+
+    Yields:
+        lxml.etree._Element: The OAI-PMH record elements.
+    """
+    if not filepath.lower().endswith(".xml"):
+        raise ValueError("Invalid path to file. Must be in .xml format.")
+    for _, record in etree.iterparse(filepath, events=("end",), tag="{" + get_namespaces()["oai"] + "}record"):
+        if where is None or where(record):
+            yield record
+        record.clear()
+        while record.getprevious() is not None:
+            del record.getparent()[0]
+
+
+def read_oai_header(record: etree._Element):
+    """
+    Returns the header of an OAI-PMH record element as a dictionary (see read_oai_headers),
+    or None if the record has no header.
+    """
+    oai = "{" + get_namespaces()["oai"] + "}"
+    header = record.find(oai + "header")
+    if header is None:
+        return None
+    return {"identifier": header.findtext(oai + "identifier"),
+            "datestamp": header.findtext(oai + "datestamp"),
+            "setSpec": "; ".join(s.text for s in header.iterfind(oai + "setSpec") if s.text),
+            "deleted": header.get("status") == "deleted"}
+
+
+def read_oai_headers(filepath: str):
+    """
+    Streams over an OAI-PMH XML file and yields the header of each record, without parsing the metadata.
+
+    Args:
+        filepath (str): The path to the OAI-PMH XML file.
+
+    Yields:
+        dict: The record identifier, datestamp, set memberships (joined with "; ") and deletion status.
+    """
+    oai = "{" + get_namespaces()["oai"] + "}"
+    for _, record in etree.iterparse(filepath, events=("end",), tag=oai + "record"):
+        header = read_oai_header(record)
+        if header is not None:
+            yield header
+        # free the finished record, since we only need the headers
+        record.clear()
+        while record.getprevious() is not None:
+            del record.getparent()[0]
+
+
+def object_array(values: list) -> np.ndarray:
+    """A 1-D object array of the values, which may be lists (numpy would turn equally long lists into a 2-D array)."""
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+def marc_records_to_frame_vectorized(records, paths: set=None, multivalue: str="join", control_fields: bool=False) -> pd.DataFrame:
+    """
+    Builds the same DataFrame as `pd.DataFrame.from_records(MARCrecordParser(record).parse() for record in records)`,
+    but collects the raw values of all records first, cleans each distinct value only once and builds the
+    columns with numpy instead of a dictionary per record.
+    """
+    record_index, field_paths, values = [], [], []
+    parser = None
+    n_records = 0
+    for i, record in enumerate(records):
+        n_records += 1
+        parser = MARCrecordParser(record, paths=paths, control_fields=control_fields)
+        for path, value in parser.iter_raw_fields():
+            record_index.append(i)
+            field_paths.append(path)
+            values.append(parser.handle_person_subfields(value) if type(value) == dict else value)
+    if len(values) == 0:
+        return pd.DataFrame(index=range(n_records))
+
+    # as MARCrecordParser.append_field, but once per distinct value
+    cleaned = {}
+    for value in dict.fromkeys(values):
+        try:
+            cleaned[value] = parser.clean_field(value)
+        except IndexError:
+            cleaned[value] = value
+    records = np.array(record_index, dtype=int)
+    path_codes, paths = pd.factorize(np.array(field_paths, dtype=object))
+    cells = object_array([cleaned[value] for value in values])
+
+    # collect the repeated fields of a record in their original order
+    keys = pd.Series(records * len(paths) + path_codes)
+    repeated = keys.duplicated(keep=False).to_numpy()
+    if repeated.any():
+        collected = {}
+        for key, value in zip(keys[repeated], cells[repeated]):
+            if key in collected:
+                collected[key].append(value)
+            else:
+                collected[key] = [value]
+        first = ~keys.duplicated(keep="first").to_numpy()
+        records, path_codes, keys, cells = records[first], path_codes[first], keys[first].to_numpy(), cells[first]
+        repeated = repeated[first]
+        to_join = np.flatnonzero(repeated)
+        cells[to_join] = object_array([collected[key] if multivalue == "list" else "; ".join(collected[key])
+                                       for key in keys[to_join]])
+
+    tags = np.array([int(path.split("$")[0]) for path in paths], dtype=int)
+    if multivalue == "list":
+        # as in MARCrecordParser, all data fields are lists, the control fields (001-009) stay strings
+        to_wrap = np.flatnonzero((tags[path_codes] >= 10) & ~repeated)
+        cells[to_wrap] = object_array([[value] for value in cells[to_wrap]])
+
+    # columns appear in the order in which they are first seen in the (tag-sorted) records
+    column_codes = pd.unique(path_codes[np.argsort(records * 1000 + tags[path_codes], kind="mergesort")])
+    table = np.full((n_records, len(paths)), np.nan, dtype=object)
+    table[records, path_codes] = cells
+    return pd.DataFrame(table[:, column_codes], columns=list(paths[column_codes]))
+
+
+def marc_to_dataframe(records, columns_dict, threshold, replace_columns, vectorized=False, paths=None, multivalue="join",
+                      control_fields=False):
+    if vectorized:
+        df = marc_records_to_frame_vectorized(records, paths=paths, multivalue=multivalue, control_fields=control_fields)
+    else:
+        df = pd.DataFrame.from_records((MARCrecordParser(record, paths=paths, multivalue=multivalue,
+                                                         control_fields=control_fields).parse()
+                                        for record in records))
     column_population = df.notna().sum() / len(df) # how populated the columns are
     df = df[column_population.loc[column_population > threshold].index].copy()
     if replace_columns:
@@ -314,6 +692,15 @@ def marc_to_dataframe(records, columns_dict, threshold, replace_columns):
     return df
 
 
+def buffers_to_frame(buffers: ColumnBuffers, backend: str, threshold: float=0, columns_dict: dict=None):
+    if backend == "arrow":
+        return buffers.to_arrow(threshold=threshold, columns_dict=columns_dict)
+    elif backend == "polars":
+        return buffers.to_polars(threshold=threshold, columns_dict=columns_dict)
+    else:
+        raise ValueError(f"Unknown backend: {backend}. Must be one of {backends}.")
+
+
 def get_namespaces():
     return {"xsi": "http://www.w3.org/2001/XMLSchema-instance",
             "oai": "http://www.openarchives.org/OAI/2.0/",
@@ -339,9 +726,55 @@ def detect_format(tree):
         raise ValueError("Cannot determine data format. The OAI-PMH ListRecords response must be made up of either EDM or MARC21XML records.")
 
 
-def oai_to_dataframe(filepath: str, marc_threshold: float=0.1, replace_columns: bool=True) -> pd.DataFrame:
+def detect_file_format(filepath: str):
+    """
+    Detects whether an XML file contains MARC or EDM records, like detect_format(),
+    but only reads the file up to the first record instead of parsing the whole tree.
     """
-    Converts an OAI-PMH file to a pandas DataFrame.
+    ns = get_namespaces()
+    for _, element in etree.iterparse(filepath, events=("start",)):
+        parent = element.getparent()
+        if element.tag == "{%s}record" % ns["marc"]:
+            if parent is not None and parent.tag == "{%s}metadata" % ns["oai"]:
+                print("Detected MARC format in OAI-PMH protocol. Proceeding to convert.")
+            else:
+                print("Detected MARC format without OAI-PMH protocol. Attempting to convert...")
+            return "marc"
+        elif element.tag.startswith("{%s}" % ns["edm"]) and parent is not None and parent.tag == "{%s}RDF" % ns["rdf"]:
+            print("Detected EDM format. Proceeding to convert.")
+            return "edm"
+    raise ValueError("Cannot determine data format. The OAI-PMH ListRecords response must be made up of either EDM or MARC21XML records.")
+
+
+def resolve_marc_fields(fields: list) -> set:
+    """
+    Translates a list of MARC paths (e.g. "245$a", "100") or informative column names from `marc_columns_dict`
+    (e.g. "title", "creator") to the set of MARC paths to extract. The person fields 100, 600 and 700 are
+    extracted as a whole (as in the "creator", "subject_person" and "contributor" columns).
+    """
+    paths_by_name = {}
+    for path, name in marc_columns_dict.items():
+        paths_by_name.setdefault(name, []).append(path)
+    paths = set()
+    for field in fields:
+        for path in paths_by_name.get(field, [field]):
+            tag = path.split("$")[0]
+            paths.add(tag if tag in ["100", "600", "700"] else path)
+    return paths
+
+
+def record_filter(where):
+    """Turns a record predicate into a transform for read_marc_records, which drops the rejected records."""
+    if where is None:
+        return None
+    return lambda record: record if where(record) else None
+
+
+def oai_to_dataframe(filepath: str, marc_threshold: float=0.1, replace_columns: bool=True, vectorized: bool=False,
+                     backend: str="pandas", fields: list=None, where=None, multivalue: str="join",
+                     full_edm: bool=False, control_fields: bool=False):
+    """
+    Converts an OAI-PMH file to a pandas DataFrame (or a pyarrow Table or polars DataFrame, see `backend`).
 
     Parameters:
     -----------
@@ -353,51 +786,119 @@ def oai_to_dataframe(filepath: str, marc_threshold: float=0.1, replace_columns:
     replace_columns : bool, optional (default=True)
         In the case of MARC data, whether to replace the MARC field names with more informative ones
         (these unofficial field names are hand-crafted for about 200 different fields).
+    vectorized : bool, optional (default=False)
+        In the case of MARC data, whether to collect the raw field values of all records first, clean each
+        distinct value once and build the columns with numpy, instead of building a dictionary per record.
+        The output is identical. Only available with the pandas backend.
+    backend : str, optional (default="pandas")
+        "pandas", "arrow" or "polars". With "arrow" and "polars", the parsed records are collected into
+        column buffers and the result is built directly as a pyarrow.Table or polars.DataFrame, without the
+        intermediate row dictionaries and dtype conversion of pandas (use `.to_pandas()` if needed).
+        These need the optional pyarrow or polars package. As both need unique column names, a MARC column
+        whose informative name is already taken keeps its field code (e.g. "700$g").
+    fields : list, optional (default=None)
+        Only extract these fields. For MARC data, these are MARC paths (e.g. "260$c", "100") or informative
+        column names (e.g. "title", "creator", "language"); all other fields are skipped while parsing the XML.
+        For EDM data, these are the output column names (e.g. "title", "isbn", "year").
+        Note that `marc_threshold` still applies to the selected columns.
+    where : callable, optional (default=None)
+        A predicate that decides which records to keep. It is called with each pymarc.Record (MARC data)
+        or lxml record element (EDM data) before the record is flattened, and the rejected records are
+        discarded. For MARC data, the predicate only sees the fields selected with `fields`.
+    multivalue : str, optional (default="join")
+        How the values of repeated fields (e.g. several subjects or contributors) are returned. "join" joins
+        them into one string with "; ". "list" returns list columns instead: the values of every MARC data
+        field (and of every DC field except the year) are lists, also when there is only one value, so that
+        they do not need to be split again and values containing "; " stay intact. In pandas these are
+        Python lists in object columns, in Arrow and Polars native list<string> columns.
+    full_edm : bool, optional (default=False)
+        In the case of EDM data, whether to extract the full set of EDM properties listed in `edm_columns_dict`
+        (DC terms, edm:type, the aggregation's data provider, rights statement and links to the object,
+        the web resources etc.) with EDMrecordParser, instead of the Dublin Core fields only.
+    control_fields : bool, optional (default=False)
+        In the case of MARC data, whether to keep the fixed-length control fields 006, 007 and 008
+        (e.g. for the publication year in 008, see publication_year).
 
     Returns:
     --------
-    pandas.DataFrame
+    pandas.DataFrame, pyarrow.Table or polars.DataFrame
         A DataFrame containing the extracted metadata, with columns corresponding to
         the Dublin Core (DC) elements or MARC fields.
 
     Raises:
     -------
     ValueError
-        If the input file is not in a supported format.
+        If the input file is not in a supported format, or the backend is not supported.
 
     Examples:
     ---------
     >>> df = oai_to_dataframe("my_file.xml")
     >>> df.head()
+    >>> table = oai_to_dataframe("my_file.xml", backend="arrow")
+    >>> df = oai_to_dataframe("erb.xml", fields=["title", "creator", "260$c", "language"],
+    ...                       where=lambda record: "est" in record.get_fields("041")[0].get_subfields("a") if record.get_fields("041") else False)
 
     """
-
-    f = open(filepath, "r", encoding="utf8")
-    tree = etree.parse(f)
-    format = detect_format(tree)
+    if backend not in backends:
+        raise ValueError(f"Unknown backend: {backend}. Must be one of {backends}.")
+    if vectorized and backend != "pandas":
+        raise ValueError("Vectorized cleaning is only available with the pandas backend.")
+    if multivalue not in multivalue_modes:
+        raise ValueError(f"Unknown multivalue mode: {multivalue}. Must be one of {multivalue_modes}.")
+
+    format = detect_file_format(filepath)
     if format == "edm":
-        xml_records = read_edm_records(tree)
-        f.close()
-        dc_records = (DCrecordParser(record).parse() for record in xml_records)
+        projection = set(fields) if fields is not None else None
+        xml_records = iter_edm_records(filepath, where=where)
+        parser = EDMrecordParser if full_edm else DCrecordParser
+        dc_records = (parser(record, projection=projection, multivalue=multivalue).parse() for record in xml_records)
+        if backend != "pandas":
+            buffers = ColumnBuffers()
+            for record in dc_records:
+                buffers.append(record)
+            return buffers_to_frame(buffers, backend)
         df = pd.DataFrame.from_records(dc_records).convert_dtypes()
         return df
     elif format == "marc":
-        f.close()
-        marc_records = read_marc_records(filepath)
+        paths = resolve_marc_fields(fields) if fields is not None else None
+        tags = {path.split("$")[0] for path in paths} if paths is not None else None
+        if backend != "pandas":
+            buffers = ColumnBuffers()
+            def append_record(record):
+                if where is None or where(record):
+                    buffers.append(MARCrecordParser(record, paths=paths, multivalue=multivalue,
+                                                    control_fields=control_fields).parse())
+            read_marc_records(filepath, transform=append_record, tags=tags)
+            return buffers_to_frame(buffers, backend,
+                                    threshold=marc_threshold,
+                                    columns_dict=marc_columns_dict if replace_columns else None)
+        marc_records = read_marc_records(filepath, transform=record_filter(where), tags=tags)
         df = marc_to_dataframe(records=marc_records,
                                columns_dict=marc_columns_dict,
                                threshold=marc_threshold,
-                               replace_columns=replace_columns).convert_dtypes()
+                               replace_columns=replace_columns,
+                               vectorized=vectorized,
+                               paths=paths,
+                               multivalue=multivalue,
+                               control_fields=control_fields).convert_dtypes()
         return df
     
 
-def oai_to_dict(filepath: str):
+def oai_to_dict(filepath: str, compact: bool=False, fields: list=None, where=None, full_edm: bool=False):
     """
     Parses an OAI-PMH XML file at `filepath` and returns a dictionary
     containing the records as either EDM Dublin Core or MARC21XML.
 
     Args:
         filepath (str): The path to the OAI-PMH XML file to parse.
+        compact (bool, optional): Whether to return the records in a compact form that needs a fraction
+            of the memory (default=False). See the `Returns` section for details.
+        fields (list, optional): Only extract these fields (see oai_to_dataframe). As the MARC records are
+            returned unflattened, the selection applies to whole MARC fields (e.g. "260$c" keeps all of 260).
+        where (callable, optional): A predicate on the pymarc.Record (MARC) or lxml record element (EDM)
+            that decides which records to keep (see oai_to_dataframe).
+        full_edm (bool, optional): Extract the full set of EDM properties instead of the Dublin Core fields
+            (see oai_to_dataframe).
 
     Returns:
         dict: A dictionary containing the parsed records. The keys of the dictionary
@@ -405,22 +906,37 @@ def oai_to_dict(filepath: str):
         for each record. The values of the dictionary are the records themselves,
         represented as dictionaries.
 
+        If `compact` is True, the "records" value is a list of read-only compact.CompactRecord objects
+        instead, which share interned field paths and common values, and return a tuple of values for each
+        path. MARC records are flattened to "tag$code" paths that keep the occurrence of their field
+        (see CompactRecord.from_marc and CompactRecord.fields), and the repeated values of EDM fields
+        are kept apart (see CompactRecord.from_dict).
+
     Raises:
         TypeError: If the format of the XML file at `filepath` is not EDM or MARC21XML.
     """
-    f = open(filepath, "r", encoding="utf8")
-    tree = etree.parse(f)
-    format = detect_format(tree)
+    format = detect_file_format(filepath)
     if format == "edm":
-        xml_records = read_edm_records(tree)
-        f.close()
+        projection = set(fields) if fields is not None else None
+        parser = EDMrecordParser if full_edm else DCrecordParser
+        xml_records = iter_edm_records(filepath, where=where)
+        if compact:
+            interner = Interner()
+            return {"records": [CompactRecord.from_dict(parser(record, projection=projection, multivalue="list").parse(), interner)
+                                for record in xml_records]}
         json_records = {"records": {}}
         for i, record in enumerate(xml_records):
-            json_records["records"][str(i)] = DCrecordParser(record).parse()
+            json_records["records"][str(i)] = parser(record, projection=projection).parse()
         return json_records
     elif format == "marc":
-        f.close()
-        marc_records = read_marc_records(filepath)
+        tags = {path.split("$")[0] for path in resolve_marc_fields(fields)} if fields is not None else None
+        if compact:
+            interner = Interner()
+            def to_compact(record):
+                if where is None or where(record):
+                    return CompactRecord.from_marc(record, interner)
+            return {"records": read_marc_records(filepath, transform=to_compact, tags=tags)}
+        marc_records = read_marc_records(filepath, transform=record_filter(where), tags=tags)
         json_records = {"records": {}}
         for i, record in enumerate(marc_records):
             json_records["records"][str(i)] = record.as_dict()
@@ -429,13 +945,16 @@ def oai_to_dict(filepath: str):
         raise TypeError("The filepath provided does not seem to contain EDM Dublin Core or MARC21XML records.")
 
 
-def oai_to_json(filepath: str, json_output_path: str):
+def oai_to_json(filepath: str, json_output_path: str, fields: list=None, where=None, full_edm: bool=False):
     """
     Converts an OAI-PMH XML file containing EDM Dublin Core or MARC21XML records to a JSON file.
 
     Args:
         filepath (str): The path to the input OAI-PMH XML file.
         json_output_path (str): The path where the output JSON file will be saved.
+        fields (list, optional): Only extract these fields (see oai_to_dict).
+        where (callable, optional): A predicate that decides which records to keep (see oai_to_dict).
+        full_edm (bool, optional): Extract the full set of EDM properties (see oai_to_dataframe).
 
     Returns:
         None
@@ -443,7 +962,7 @@ def oai_to_json(filepath: str, json_output_path: str):
     Raises:
         TypeError: If the OAI-PMH XML file does not contain EDM Dublin Core or MARC21XML records.
     """
-    json_records = oai_to_dict(filepath)
+    json_records = oai_to_dict(filepath, fields=fields, where=where, full_edm=full_edm)
     with open(json_output_path, "w", encoding="utf8") as f:
         json.dump(json_records, f)
 
@@ -650,4 +1169,65 @@ marc_columns_dict = {
     "856$z": "electronic_access_note",
     "856$u": "electronic_access_URI",
     "866$a": "undefined_rara_field",
-    }
\ No newline at end of file
+    }
+
+
+# the EDM properties extracted by EDMrecordParser, as {"section/property": column};
+# "@rdf:about" stands for the URI of the section itself
+edm_columns_dict = {
+    "edm:ProvidedCHO/@rdf:about": "cho_uri",
+    "edm:ProvidedCHO/dc:title": "title",
+    "edm:ProvidedCHO/dcterms:alternative": "alternative",
+    "edm:ProvidedCHO/dc:creator": "creator",
+    "edm:ProvidedCHO/dc:contributor": "contributor",
+    "edm:ProvidedCHO/dc:subject": "subject",
+    "edm:ProvidedCHO/dc:description": "description",
+    "edm:ProvidedCHO/dcterms:tableOfContents": "table_of_contents",
+    "edm:ProvidedCHO/dc:publisher": "publisher",
+    "edm:ProvidedCHO/dc:date": "date",
+    "edm:ProvidedCHO/dcterms:created": "created",
+    "edm:ProvidedCHO/dcterms:issued": "issued",
+    "edm:ProvidedCHO/dc:type": "type",
+    "edm:ProvidedCHO/edm:type": "edm_type",
+    "edm:ProvidedCHO/dc:format": "format",
+    "edm:ProvidedCHO/dcterms:extent": "extent",
+    "edm:ProvidedCHO/dcterms:medium": "medium",
+    "edm:ProvidedCHO/dc:language": "language",
+    "edm:ProvidedCHO/dc:coverage": "coverage",
+    "edm:ProvidedCHO/dcterms:spatial": "spatial",
+    "edm:ProvidedCHO/dcterms:temporal": "temporal",
+    "edm:ProvidedCHO/dc:relation": "relation",
+    "edm:ProvidedCHO/dcterms:isPartOf": "is_part_of",
+    "edm:ProvidedCHO/dcterms:hasPart": "has_part",
+    "edm:ProvidedCHO/dcterms:isVersionOf": "is_version_of",
+    "edm:ProvidedCHO/dcterms:isReferencedBy": "is_referenced_by",
+    "edm:ProvidedCHO/edm:isNextInSequence": "is_next_in_sequence",
+    "edm:ProvidedCHO/dc:rights": "rights",
+    "edm:ProvidedCHO/dcterms:provenance": "provenance",
+    "edm:ProvidedCHO/dc:source": "source",
+    "edm:ProvidedCHO/dc:identifier": "identifier",
+    "edm:ProvidedCHO/edm:currentLocation": "current_location",
+    "edm:ProvidedCHO/owl:sameAs": "same_as",
+    "ore:Aggregation/@rdf:about": "aggregation_uri",
+    "ore:Aggregation/edm:dataProvider": "data_provider",
+    "ore:Aggregation/edm:provider": "provider",
+    "ore:Aggregation/edm:intermediateProvider": "intermediate_provider",
+    "ore:Aggregation/edm:isShownAt": "is_shown_at",
+    "ore:Aggregation/edm:isShownBy": "is_shown_by",
+    "ore:Aggregation/edm:object": "object",
+    "ore:Aggregation/edm:hasView": "has_view",
+    "ore:Aggregation/edm:rights": "rights_statement",
+    "ore:Aggregation/dc:rights": "aggregation_rights",
+    "ore:Aggregation/edm:ugc": "ugc",
+    "edm:WebResource/@rdf:about": "web_resource",
+    "edm:WebResource/dc:format": "web_resource_format",
+    "edm:WebResource/dcterms:extent": "web_resource_extent",
+    "edm:WebResource/dc:rights": "web_resource_rights",
+    "edm:WebResource/edm:rights": "web_resource_rights_statement",
+    "edm:Agent/skos:prefLabel": "agent",
+    "edm:Place/skos:prefLabel": "place",
+    "edm:TimeSpan/skos:prefLabel": "timespan",
+    "skos:Concept/skos:prefLabel": "concept",
+    }
+
+edm_lookup = compile_edm_columns(edm_columns_dict)
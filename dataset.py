@@ -0,0 +1,209 @@
+import os
+import re
+import shutil
+
+from columnar import import_backend
+from converter import oai_to_dataframe, marc_columns_dict, edm_columns_dict, publication_year
+
+
+# the output columns of DCrecordParser (besides the language-tagged variants, e.g. "title_et")
+dc_columns = ["title", "alternative", "creator", "contributor", "subject", "description", "publisher",
+              "date", "year", "type", "format", "language", "coverage", "relation", "rights", "source",
+              "isbn", "ester_url", "digar_url", "other_identifier"]
+
+partition_columns = ["collection", "decade", "language_code"]
+
+# the language tags of language-tagged DC columns (e.g. "title_et", "title_en-GB")
+language_tag_pattern = re.compile("[A-Za-z]{2,3}(-[A-Za-z0-9]+)*")
+
+# ISO 639-1 codes and ISO 639-2/T codes mapped to the MARC (ISO 639-2/B) language codes, for the language_code partitions
+language_codes = {"et": "est", "en": "eng", "de": "ger", "ru": "rus", "fi": "fin", "fr": "fre", "sv": "swe",
+                  "lv": "lav", "lt": "lit", "la": "lat", "pl": "pol", "it": "ita", "es": "spa", "da": "dan",
+                  "no": "nor", "nb": "nob", "nn": "nno", "uk": "ukr", "hu": "hun", "cs": "cze", "nl": "dut",
+                  "be": "bel", "he": "heb", "yi": "yid", "ja": "jpn", "zh": "chi", "pt": "por", "el": "gre",
+                  "is": "ice", "ka": "geo", "hy": "arm", "sk": "slo", "sl": "slv", "ro": "rum", "bg": "bul",
+                  "sr": "srp", "hr": "hrv", "tr": "tur", "eo": "epo", "se": "sme", "ar": "ara",
+                  "deu": "ger", "fra": "fre", "ces": "cze", "nld": "dut", "zho": "chi", "ell": "gre", "isl": "ice",
+                  "kat": "geo", "hye": "arm", "slk": "slo", "ron": "rum"}
+
+
+def unified_schema(multivalue: str="join"):
+    """
+    Returns the pyarrow schema shared by all collections of the dataset: the informative MARC column names
+    from `marc_columns_dict`, the Dublin Core fields, the EDM properties of `edm_columns_dict` (filled when
+    converting with full_edm=True), the derived publication year and the partition columns.
+    All columns are strings, except for the year and the decade. With multivalue="list", the columns of
+    the MARC data fields and of the DC fields are lists of strings (see oai_to_dataframe).
+    """
+    pa = import_backend("arrow")
+    edm_columns = [column for column in edm_columns_dict.values() if column != "identifier"]
+    names = list(dict.fromkeys(list(marc_columns_dict.values()) + dc_columns + edm_columns))
+    control_names = {name for path, name in marc_columns_dict.items() if path < "010"}
+    value_type = pa.list_(pa.string()) if multivalue == "list" else pa.string()
+    fields = [pa.field(name, pa.int64() if name == "year" else pa.string() if name in control_names else value_type)
+              for name in names]
+    fields += [pa.field("collection", pa.string()),
+               pa.field("decade", pa.int64()),
+               pa.field("language_code", pa.string())]
+    return pa.schema(fields)
+
+
+def first_value(value):
+    """Returns the first of the values joined with "; " or of a list of values (or None)."""
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value.split("; ")[0]
+
+
+def derive_year(table) -> list:
+    """
+    The publication year of each record: the year of DC records, or else the year of the first MARC
+    publication date (260$c, 264$c) or of the 008 field (see converter.publication_year).
+    """
+    if "year" in table.column_names:
+        return table["year"].to_pylist()
+    date_columns = [[first_value(value) for value in table[column].to_pylist()]
+                    for column in ["publication_date", "production_publication_distribution_date", "260$c", "264$c"]
+                    if column in table.column_names]
+    fixed_column = next((column for column in ["fixed_len_data", "008"] if column in table.column_names), None)
+    fixed_data = table[fixed_column].to_pylist() if fixed_column is not None else [None] * table.num_rows
+    return [publication_year([dates[i] for dates in date_columns], fixed_data[i]) for i in range(table.num_rows)]
+
+
+def normalize_language(value: str):
+    """
+    Normalizes a language value to a MARC language code for the language_code partitions: the first
+    three-letter code of the value (MARC 041$a may run several codes together, e.g. "estrus"), with
+    ISO 639-1 and ISO 639-2/T codes mapped to the MARC codes (e.g. "et" to "est", "deu" to "ger").
+    Other values (e.g. language names) become "und" (undetermined).
+    """
+    if value is None:
+        return None
+    value = value.strip().lower()
+    if not value:
+        return None
+    code = re.split("[-_; ,]", value)[0]
+    if len(code) > 3 and len(code) % 3 == 0 and code.isalpha():
+        code = code[:3]
+    code = language_codes.get(code, code)
+    if len(code) == 3 and code.isalpha() and code.isascii():
+        return code
+    return "und"
+
+
+def fold_language_columns(table, schema):
+    """
+    Folds the language-tagged DC columns (e.g. "title_et", "subject_en") into their base columns of the
+    schema ("title", "subject"), after the untagged values: joined with "; " or, for list columns, concatenated.
+    """
+    pa = import_backend("arrow")
+    base_names = set(dc_columns) | set(edm_columns_dict.values())
+    groups = {}
+    for name in table.column_names:
+        if schema.get_field_index(name) != -1 or "_" not in name:
+            continue
+        base, tag = name.rsplit("_", 1)
+        if base in base_names and schema.get_field_index(base) != -1 and language_tag_pattern.fullmatch(tag):
+            groups.setdefault(base, []).append(name)
+    for base, variants in groups.items():
+        is_list = pa.types.is_list(schema.field(base).type)
+        columns = ([base] if base in table.column_names else []) + variants
+        merged = []
+        for values in zip(*(table[column].to_pylist() for column in columns)):
+            parts = []
+            for value in values:
+                if isinstance(value, list):
+                    parts += value
+                elif value is not None:
+                    parts.append(value)
+            merged.append((parts if is_list else "; ".join(parts)) if parts else None)
+        table = table.drop(columns)
+        table = table.append_column(base, pa.array(merged, type=schema.field(base).type))
+    return table
+
+
+def conform_table(table, schema, collection: str, verbose: bool=True):
+    """
+    Conforms a converted collection to the unified schema: folds the language-tagged DC columns into
+    their base columns, adds the derived and partition columns, fills the missing columns with nulls
+    and drops the columns that are not part of the schema (and reports them if `verbose`).
+    """
+    pa = import_backend("arrow")
+    table = fold_language_columns(table, schema)
+    years = derive_year(table)
+    if "language" in table.column_names:
+        languages = [first_value(language) for language in table["language"].to_pylist()]
+    else:
+        languages = [None] * table.num_rows
+    derived = {"year": years,
+               "collection": [collection] * table.num_rows,
+               "decade": [year // 10 * 10 if year is not None else None for year in years],
+               "language_code": [normalize_language(language) for language in languages]}
+    dropped = [name for name in table.column_names if schema.get_field_index(name) == -1]
+    if dropped and verbose:
+        print(f"{collection}: {len(dropped)} columns are not part of the unified schema and were left out")
+    arrays = []
+    for field in schema:
+        if field.name in derived:
+            arrays.append(pa.array(derived[field.name], type=field.type))
+        elif field.name in table.column_names:
+            arrays.append(table[field.name].cast(field.type))
+        else:
+            arrays.append(pa.nulls(table.num_rows, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_parquet_dataset(sources, base_dir: str, partition_by: list=partition_columns, max_partitions: int=10000,
+                          multivalue: str="join", **kwargs) -> None:
+    """
+    Converts a set of harvested OAI-PMH files into one Hive-partitioned Parquet dataset with a unified schema,
+    e.g. base_dir/collection=erb_books/decade=1930/language_code=est/erb_books-0.parquet.
+
+    Query engines (pyarrow.dataset, DuckDB, Polars, Spark etc.) can then prune the partitions and only read
+    the slices they need. Each collection is written to its own collection=<key> directory, which is replaced
+    if the collection is written again. Needs the pyarrow package.
+
+    Args:
+        sources (dict or list): The harvested files, as {collection_key: filepath}, or a list of file paths
+            (the collection key is then the file name without the .xml extension).
+        base_dir (str): The root directory of the dataset.
+        partition_by (list, optional): The partition columns, from "collection", "decade" (the decade of the
+            publication year, e.g. 1930) and "language_code" (the first language, as a MARC language code,
+            see normalize_language). Default: all three.
+        max_partitions (int, optional): The maximum number of partitions written for one collection (default=10000).
+        multivalue (str, optional): "join" (default) or "list", to store repeated values as list columns
+            (see oai_to_dataframe). All collections of a dataset should be written with the same mode.
+        **kwargs: Passed on to oai_to_dataframe (e.g. `fields`, `where` or `full_edm`).
+
+    Returns:
+        None
+
+    Example:
+        >>> write_parquet_dataset(["data/erb_books.xml", "data/erb_periodicals.xml"], "data/dataset")
+        >>> import pyarrow.dataset as ds
+        >>> dataset = ds.dataset("data/dataset", partitioning="hive")
+        >>> dataset.to_table(filter=(ds.field("decade") == 1930) & (ds.field("language_code") == "est"))
+    """
+    pa = import_backend("arrow")
+    import pyarrow.dataset as ds
+
+    if not isinstance(sources, dict):
+        sources = {os.path.splitext(os.path.basename(filepath))[0]: filepath for filepath in sources}
+    schema = unified_schema(multivalue)
+    partitioning = ds.partitioning(pa.schema([schema.field(name) for name in partition_by]), flavor="hive")
+    for collection, filepath in sources.items():
+        print(f"Converting {collection}")
+        # the 008 field is kept for the publication year of the MARC records without a publication date
+        kwargs.setdefault("control_fields", True)
+        table = oai_to_dataframe(filepath, marc_threshold=0, backend="arrow", multivalue=multivalue, **kwargs)
+        table = conform_table(table, schema, collection)
+        if "collection" in partition_by:
+            shutil.rmtree(os.path.join(base_dir, f"collection={collection}"), ignore_errors=True)
+        ds.write_dataset(table, base_dir,
+                         format="parquet",
+                         partitioning=partitioning,
+                         basename_template=f"{collection}-{{i}}.parquet",
+                         existing_data_behavior="overwrite_or_ignore",
+                         max_partitions=max_partitions)
@@ -1,12 +1,18 @@
 import sys
-from harvester import collections, harvest_oai
+from harvester import collections, harvest_oai, harvest_superset, group_subsets
 
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         start = int(sys.argv[1])
     else:
         start = 0
-    for key in list(collections.keys())[start:]:
+    # the subsets of a collection (e.g. the ERB sets) are split from its harvest instead of being downloaded again
+    for key, subsets in group_subsets(list(collections.keys())[start:]).items():
         print(f"Collecting {collections[key]['title']}")
-        harvest_oai(key=key,
-                    savepath=f"data/{key}.xml")
\ No newline at end of file
+        if subsets:
+            harvest_superset(key=key,
+                             savedir="data",
+                             subsets=subsets)
+        else:
+            harvest_oai(key=key,
+                        savepath=f"data/{key}.xml")
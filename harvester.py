@@ -1,9 +1,19 @@
 import os
 import json
+import time
+import copy
+from urllib.parse import urlparse, parse_qsl, urlencode
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import requests
 from lxml import etree
 from lxml.etree import ElementTree as ET
+from oai_collections import collections
+from rate_control import RateController, parse_retry_after
+
+
+base_URL = "https://data.digar.ee/repox/OAIHandler"
 
 
 ns = {"oai": "http://www.openarchives.org/OAI/2.0/",
@@ -36,7 +46,57 @@ def update_cursor(token: str, step: int):
         return ":".join([token_id, collection, metadata_prefix, new_cursor, collection_size, ":"])
 
 
-def request_records(collection_URL=None, token=None):
+def fetch(URL: str, controller: RateController=None, session=None, max_retries: int=5, timeout: float=300) -> bytes:
+    """
+    Sends a GET request under the control of a RateController and returns the response body.
+
+    429 and 503 responses (with their Retry-After header), connection errors, timeouts and other 5xx responses
+    are reported to the controller, which lowers the concurrency and pauses, and the request is retried up to
+    `max_retries` times. Other client errors (4xx) are raised immediately.
+
+    Args:
+        URL (str): The URL to request.
+        controller (RateController, optional): The rate controller shared by the requests of a harvest.
+            By default, a new single-request controller (i.e. sequential requests with retries).
+        session (requests.Session, optional): A session for reusing the connections.
+        max_retries (int, optional): The number of retries after a failed request (default=5).
+        timeout (float, optional): The request timeout in seconds (default=300).
+
+    Returns:
+        bytes: The response body (undecoded, so that the XML parser applies the encoding of the XML declaration).
+
+    Raises:
+        requests.HTTPError, requests.RequestException: If the request still fails after the retries.
+    """
+    if controller is None:
+        controller = RateController(max_concurrency=1)
+    session = session or requests
+    for attempt in range(max_retries + 1):
+        controller.acquire()
+        try:
+            start = time.monotonic()
+            try:
+                response = session.get(URL, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                controller.on_error()
+                if attempt == max_retries:
+                    raise
+                continue
+            if response.status_code in [429, 503]:
+                controller.on_throttle(parse_retry_after(response.headers.get("Retry-After")))
+            elif response.status_code >= 500:
+                controller.on_error()
+            else:
+                response.raise_for_status()
+                controller.on_success(time.monotonic() - start)
+                return response.content
+            if attempt == max_retries:
+                response.raise_for_status()
+        finally:
+            controller.release()
+
+
+def request_records(collection_URL=None, token=None, controller=None, session=None, base_URL=base_URL):
     """
     Given an OAI-PMH collection URL or a resumptionToken, sends a request to the endpoint and retrieves the corresponding
     ListRecords element. If an initial request is made, returns both the records and the resumptionToken, as well as the
@@ -45,6 +105,9 @@ def request_records(collection_URL=None, token=None):
     Parameters:
     - collection_URL (str): the OAI-PMH collection URL to query.
     - token (str): the resumptionToken to use to continue a previous query.
+    - controller (RateController): the rate controller for the request (see fetch()).
+    - session (requests.Session): a session for reusing the connections.
+    - base_URL (str): the OAI-PMH endpoint for resumptionToken requests (default: the digar.ee endpoint).
 
     Returns:
     - (lxml.etree.ElementTree): the ListRecords element corresponding to the requested records.
@@ -52,14 +115,14 @@ def request_records(collection_URL=None, token=None):
     """
     # if we don't have a resumptionToken yet, request the first batch; else use the token.
     if token is not None and collection_URL is None:
-        URL = f"https://data.digar.ee/repox/OAIHandler?verb=ListRecords&resumptionToken={token}"
+        URL = f"{base_URL}?verb=ListRecords&resumptionToken={token}"
     elif collection_URL is not None and token is None:
         URL = collection_URL
     else:
         raise AttributeError("Must provide either a resumptionToken or a collection URL (see harvester.collections for details)")
 
-    response = requests.get(URL)
-    tree = ET(etree.fromstring(bytes(response.text, encoding="utf8")))
+    response_content = fetch(URL, controller=controller, session=session)
+    tree = ET(etree.fromstring(response_content))
     root = tree.getroot()
     responseDate, request, ListRecords = root.getchildren()
 
@@ -79,26 +142,35 @@ def request_records(collection_URL=None, token=None):
         return ListRecords
     
 
-def get_collection(URL):
+def iter_batches(URL, controller=None, prefetch: int=None):
     """
-    Requests all records of a given OAI-PMH collection URL, and returns them as a list of xml ElementTree elements,
-    together with the request metadata (e.g. the resumptionToken).
+    Requests all records of a given OAI-PMH collection URL batch by batch, and yields each batch as a list of
+    xml ElementTree elements, together with the request metadata (e.g. the resumptionToken).
+
+    As the resumptionTokens of the endpoint only advance a cursor (see update_cursor), the tokens of all batches
+    are known after the initial request, and the batches are requested concurrently. The number of requests in
+    flight is adapted to the response times and throttling responses of the endpoint by a RateController.
+    The batches are yielded in order, and at most `prefetch` batches are requested ahead of the consumer.
 
     Args:
         URL (str): The URL of the OAI-PMH collection.
+        controller (RateController, optional): The rate controller to use, e.g. to tune its limits or to read
+            its metrics after the harvest. By default, a RateController with up to 4 concurrent requests.
+        prefetch (int, optional): The number of batches requested ahead (default: twice the controller's
+            max_concurrency).
 
-    Returns:
-        Tuple[List[xml.etree.ElementTree.Element], Dict[str, Any]]: A tuple containing two elements:
-            - A list of xml.etree.ElementTree.Element objects, representing the records in the collection.
-            - A dictionary containing the request metadata (e.g. the resumptionToken).
-
-    Raises:
-        AttributeError: If URL is None.
+    Yields:
+        Tuple[List[lxml.etree._Element], Dict[str, Any]]: The records of a batch and the request metadata.
     """
+    if controller is None:
+        controller = RateController()
+    if prefetch is None:
+        prefetch = 2 * controller.max_concurrency
+    session = requests.Session()
+    endpoint = URL.split("?")[0]
+
     # initial request
-    all_records = []
-    ListRecords, request_metadata = request_records(collection_URL=URL)
-    all_records += ListRecords[:-1]
+    ListRecords, request_metadata = request_records(collection_URL=URL, controller=controller, session=session)
 
     token = request_metadata["resumptionToken"]
     if token is not None:
@@ -107,13 +179,51 @@ def get_collection(URL):
         cursor_step, collection_size = 1000, len(ListRecords)
 
     progress_bar = tqdm(total=collection_size, initial=cursor_step)
-    while token is not None: # continue requesting until there is no more resumptionToken, i.e. the end of the collection is reached
-        ListRecords = request_records(token=token)
-        all_records += ListRecords[:-1] # (leave out the last element, the resumptionToken)
-        token = update_cursor(token, step=cursor_step) # update the cursor
-        progress_bar.update(len(ListRecords)-1)
-    progress_bar.close()
+    yield ListRecords[:-1], request_metadata
+
+    def request_batch(token):
+        return request_records(token=token, controller=controller, session=session, base_URL=endpoint)
+    # the rate controller limits the requests in flight; the pool only needs to be large enough for its window
+    with ThreadPoolExecutor(max_workers=controller.max_concurrency) as executor:
+        pending = deque()
+        try:
+            while token is not None or pending:
+                # keep `prefetch` batches requested ahead, until the end of the collection is reached
+                while token is not None and len(pending) < prefetch:
+                    pending.append(executor.submit(request_batch, token))
+                    token = update_cursor(token, step=cursor_step) # update the cursor
+                ListRecords = pending.popleft().result()
+                progress_bar.update(len(ListRecords)-1)
+                progress_bar.set_postfix(concurrency=int(controller.concurrency))
+                yield ListRecords[:-1], request_metadata # (leave out the last element, the resumptionToken)
+        finally:
+            # don't send the remaining requests if a batch could not be harvested or the consumer stopped
+            for future in pending:
+                future.cancel()
+            progress_bar.close()
+
+
+def get_collection(URL, controller=None):
+    """
+    Requests all records of a given OAI-PMH collection URL, and returns them as a list of xml ElementTree elements,
+    together with the request metadata (e.g. the resumptionToken). See iter_batches for the concurrent requests.
+
+    Args:
+        URL (str): The URL of the OAI-PMH collection.
+        controller (RateController, optional): The rate controller to use, e.g. to tune its limits or to read
+            its metrics after the harvest. By default, a RateController with up to 4 concurrent requests.
 
+    Returns:
+        Tuple[List[xml.etree.ElementTree.Element], Dict[str, Any]]: A tuple containing two elements:
+            - A list of xml.etree.ElementTree.Element objects, representing the records in the collection.
+            - A dictionary containing the request metadata (e.g. the resumptionToken).
+
+    Raises:
+        AttributeError: If URL is None.
+    """
+    all_records = []
+    for ListRecords, request_metadata in iter_batches(URL, controller=controller):
+        all_records += ListRecords
     return all_records, request_metadata
 
 
@@ -162,13 +272,166 @@ def write_records(ListRecords: list, metadata: dict, savepath: str) -> None:
         f.write("</OAI-PMH>")
 
 
-def harvest_oai(key: str, savepath: str) -> None:
+class OAIWriter():
+    """
+    Writes harvested records batch by batch to an OAI-PMH XML file, in the same form as write_records,
+    without keeping the whole collection in memory. The file is only created by the first write, so that
+    a harvest that fails before its first batch does not replace an existing file with an empty one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.started = False
+        self.n_records = 0
+
+    def write(self, records: list, metadata: dict):
+        self.write_serialized([etree.tostring(entry, encoding="utf8", pretty_print=True, with_tail=False).decode()
+                               for entry in records],
+                              metadata)
+
+    def write_serialized(self, records: list, metadata: dict):
+        """Writes records that are already serialized to strings (e.g. to write the same records to several files)."""
+        if not self.started:
+            self.file = open(self.path, "w", encoding="utf8")
+            self.file.write(write_start_of_string(metadata))
+            self.file.write("<ListRecords>")
+            self.started = True
+        for entry in records:
+            self.file.write(entry)
+        self.n_records += len(records)
+
+    def close(self):
+        if self.started and not self.file.closed:
+            self.file.write("</ListRecords>")
+            self.file.write("</OAI-PMH>")
+            self.file.close()
+
+
+class ShardWriter():
+    """
+    Writes harvested records to numbered shards of at most `max_records` records and/or about `max_bytes`
+    bytes of records each (e.g. data/erb_books-00000.xml, data/erb_books-00001.xml, ... for the savepath
+    data/erb_books.xml). Each shard is a standalone OAI-PMH document, which can be converted on its own.
+
+    A manifest (data/erb_books.manifest.json) lists the shards with their number of records, their size and
+    the identifiers of their first and last records. It is rewritten whenever a shard is finished, so that
+    it is up to date if the harvest is interrupted. Its "complete" flag is only set by close() at the end
+    of a successful harvest, so that an interrupted harvest is not taken for the whole collection.
+
+    The writer has the same write(records, metadata) and close() methods as OAIWriter.
+
+    Args:
+        savepath (str): The path of the unsharded file; the shards and the manifest are named after it.
+        max_records (int, optional): The largest number of records in a shard.
+        max_bytes (int, optional): The largest size of the records of a shard in bytes (a single larger
+            record still gets a shard of its own).
+
+    Attributes:
+        shards (list): The finished shards, as listed in the manifest.
+        manifest_path (str): The path of the manifest.
+        complete (bool): Whether the harvest has finished.
+
+    Example:
+        >>> writer = ShardWriter("data/erb_books.xml", max_records=50000)
+        >>> for ListRecords, metadata in iter_batches(collections["erb_books"]["OAI-PMH"]):
+        ...     writer.write(ListRecords, metadata)
+        >>> writer.close()
+    """
+
+    def __init__(self, savepath: str, max_records: int=None, max_bytes: int=None):
+        if max_records is None and max_bytes is None:
+            raise ValueError("Provide max_records, max_bytes or both.")
+        self.base = os.path.splitext(savepath)[0]
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.manifest_path = self.base + ".manifest.json"
+        self.shards = []
+        self.writer = None
+        self.complete = False
+
+    def shard_path(self, number: int) -> str:
+        return f"{self.base}-{number:05d}.xml"
+
+    def open_shard(self):
+        self.writer = OAIWriter(self.shard_path(len(self.shards)))
+        self.shard = {"path": os.path.basename(self.writer.path), "records": 0, "bytes": 0,
+                      "first_identifier": None, "last_identifier": None}
+
+    def close_shard(self):
+        self.writer.close()
+        self.shards.append(self.shard)
+        self.writer = None
+        self.write_manifest()
+
+    def write(self, records: list, metadata: dict):
+        for record in records:
+            entry = etree.tostring(record, encoding="utf8", pretty_print=True, with_tail=False)
+            if self.writer is not None and self.shard["records"] > 0 and (
+                    (self.max_records is not None and self.shard["records"] >= self.max_records)
+                    or (self.max_bytes is not None and self.shard["bytes"] + len(entry) > self.max_bytes)):
+                self.close_shard()
+            if self.writer is None:
+                self.open_shard()
+            self.writer.write_serialized([entry.decode()], metadata)
+            identifier = record.findtext("{*}header/{*}identifier")
+            if self.shard["first_identifier"] is None:
+                self.shard["first_identifier"] = identifier
+            self.shard["last_identifier"] = identifier
+            self.shard["records"] += 1
+            self.shard["bytes"] += len(entry)
+
+    def write_manifest(self):
+        manifest = {"max_records": self.max_records,
+                    "max_bytes": self.max_bytes,
+                    "records": sum(shard["records"] for shard in self.shards),
+                    "complete": self.complete,
+                    "shards": self.shards}
+        with open(self.manifest_path, "w", encoding="utf8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    def close(self, complete: bool=True):
+        """
+        Finishes the current shard and writes the manifest. Pass complete=False if the harvest failed, so that
+        the manifest keeps the shards written so far but is not marked as complete.
+        """
+        self.complete = complete
+        if self.writer is not None:
+            self.close_shard()
+        else:
+            self.write_manifest()
+
+
+def read_manifest(savepath: str, allow_incomplete: bool=False) -> list:
+    """
+    Returns the paths of the shards of a sharded harvest (see ShardWriter), given the manifest or the path
+    of the unsharded file (e.g. "data/erb_books.xml").
+
+    Raises:
+        ValueError: If the harvest did not finish (the manifest is not marked as complete), unless
+            `allow_incomplete` is True, e.g. to convert the shards of an interrupted harvest.
+    """
+    if not savepath.endswith(".manifest.json"):
+        savepath = os.path.splitext(savepath)[0] + ".manifest.json"
+    with open(savepath, encoding="utf8") as f:
+        manifest = json.load(f)
+    if not manifest.get("complete") and not allow_incomplete:
+        raise ValueError(f"The harvest of {savepath} is incomplete: it was interrupted or is still running.")
+    return [os.path.join(os.path.dirname(savepath), shard["path"]) for shard in manifest["shards"]]
+
+
+def harvest_oai(key: str, savepath: str, controller: RateController=None, shard_records: int=None,
+                shard_bytes: int=None) -> None:
     """
     Harvests metadata records from an OAI-PMH endpoint for a given collection and writes them to a file.
 
     Args:
         collection_key (str): The key of the collection to harvest. See harvester.collections for the available keys, titles and URLs.
         savepath (str): The path to the file where the harvested records will be saved.
+        controller (RateController, optional): The rate controller for the requests (see get_collection).
+        shard_records (int, optional): If given, the records are written to shards of at most this many records,
+            with a manifest, instead of a single file (see ShardWriter).
+        shard_bytes (int, optional): If given, the records are written to shards of about this many bytes.
 
     Returns:
         None.
@@ -185,156 +448,158 @@ def harvest_oai(key: str, savepath: str) -> None:
 
     """
     URL = collections[key]["OAI-PMH"]
-    ListRecords, request_metadata = get_collection(URL=URL)
+    if shard_records is not None or shard_bytes is not None:
+        # write each batch as it arrives, as the shards are meant for collections too large for one file
+        writer = ShardWriter(savepath, max_records=shard_records, max_bytes=shard_bytes)
+        try:
+            for ListRecords, request_metadata in iter_batches(URL, controller=controller):
+                writer.write(ListRecords, request_metadata)
+        except BaseException:
+            writer.close(complete=False)
+            raise
+        writer.close()
+        return
+    ListRecords, request_metadata = get_collection(URL=URL, controller=controller)
     write_records(ListRecords=ListRecords,
                   metadata=request_metadata,
                   savepath=savepath)
 
 
-collections = {
-    "erb": {
-        "title": "ERB - Estonian National Bibliography",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=erb&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "erb_books": {
-        "title": "ERB - Estonian books",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=raamat&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "erb_public_domain": {
-        "title": "ERB - works in public domain",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=vabakasutus&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "erb_non_estonian": {
-        "title": "ERB - foreign language books",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=muukeelne&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "erb_graphics": {
-        "title": "ERB - graphic material",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=piltteavikud&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "erb_maps": {
-        "title": "ERB - maps",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=kaardid&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "erb_multimedia": {
-        "title": "ERB - multimedia",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=multimeedia&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "erb_periodicals": {
-        "title": "ERB - periodicals",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=perioodika&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "erb_sheetmusic": {
-        "title": "ERB - sheet music",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=noodid&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "erb_soundrecordings": {
-        "title": "ERB - sound recordings",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=helisalvestised&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "erb_video": {
-        "title": "ERB - video",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=video&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "nle_digar": {
-        "title": "DIGAR - digital archive",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=digar&metadataPrefix=edm",
-        "original_format": "Europeana Data Model"
-    },
-    "nle_eodopen": {
-        "title": "DIGAR - EODOPEN collection",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=eodopen&metadataPrefix=marc21xml",
-        "original_format": "Europeana Data Model"
-    },
-    "nle_books": {
-        "title": "DIGAR - books",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=book&metadataPrefix=edm",
-        "original_format": "Europeana Data Model"
-    },
-    "nle_journals": {
-        "title": "DIGAR - journals",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=journal&metadataPrefix=edm",
-        "original_format": "Europeana Data Model"
-    },
-    "nle_maps": {
-        "title": "DIGAR - maps",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=map&metadataPrefix=edm",
-        "original_format": "Europeana Data Model"
-    },
-    "nle_postcards": {
-        "title": "DIGAR - postcards",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=postcard&metadataPrefix=edm",
-        "original_format": "Europeana Data Model"
-    },
-    "nle_posters": {
-        "title": "DIGAR - posters",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=poster&metadataPrefix=edm",
-        "original_format": "Europeana Data Model"
-    },
-    "nle_samplebooks": {
-        "title": "DIGAR - books sample",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=sample_book&metadataPrefix=edm",
-        "original_format": "Europeana Data Model"
-    },
-    "nle_serials": {
-        "title": "DIGAR - serials",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=serials&metadataPrefix=edm",
-        "original_format": "Europeana Data Model"
-    },
-    "nle_sheetmusic": {
-        "title": "DIGAR - sheet music",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=sheet_music&metadataPrefix=edm",
-        "original_format": "Europeana Data Model"
-    },
-    "nle_soundrecordings": {
-        "title": "DIGAR - sound recordings",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=soundrecording&metadataPrefix=edm",
-        "original_format": "Europeana Data Model"
-    },
-    "nle_standards": {
-        "title": "DIGAR - standards",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=standard&metadataPrefix=edm",
-        "original_format": "Europeana Data Model"
-    },
-    "nle_persons": {
-        "title": "Person names",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=person&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "nle_organisations": {
-        "title": "Organisation names",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=organization&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "ise_bie": {
-        "title": "Estonian Legal Bibliography",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=bie&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "ise_parliamentarism": {
-        "title": "Parliamentarism",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=parlamentism&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "ise_vpb": {
-        "title": "Bibliography - Presidents of Estonia",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=vpb&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    },
-    "ise_repros": {
-        "title": "Reproductions",
-        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=reprod&metadataPrefix=marc21xml",
-        "original_format": "MARC21XML"
-    }
-}
\ No newline at end of file
+def set_spec(URL: str) -> str:
+    """Returns the setSpec of an OAI-PMH collection URL (its `set` argument), or None."""
+    return dict(parse_qsl(urlparse(URL).query)).get("set")
+
+
+def subsets_of(key: str) -> list:
+    """Returns the keys of the collections that are subsets of the given collection (see oai_collections)."""
+    return [subset for subset, collection in collections.items() if collection.get("superset") == key]
+
+
+def group_subsets(keys: list) -> dict:
+    """
+    Groups the collections to harvest by superset: returns {key: [subset keys]}, in the order of `keys`, where
+    the subsets of a superset that is harvested too are left out of the keys and listed under their superset.
+    """
+    groups = {key: [] for key in keys if collections[key].get("superset") not in keys}
+    for key in keys:
+        if key not in groups:
+            groups[collections[key]["superset"]].append(key)
+    return groups
+
+
+def record_sets(record: etree._Element) -> list:
+    """Returns the setSpec values of the header of a harvested record."""
+    return [spec.text for spec in record.iterfind("{*}header/{*}setSpec")]
+
+
+def list_identifiers(URL: str, controller: RateController=None, session=None) -> set:
+    """
+    Returns the identifiers of all records of an OAI-PMH collection URL, with the ListIdentifiers verb,
+    which only transfers the record headers.
+    """
+    endpoint = URL.split("?")[0]
+    query = dict(parse_qsl(urlparse(URL).query))
+    query["verb"] = "ListIdentifiers"
+    URL = f"{endpoint}?{urlencode(query)}"
+    session = session or requests.Session()
+    identifiers = set()
+    while True:
+        root = etree.fromstring(fetch(URL, controller=controller, session=session))
+        for identifier in root.iterfind("{*}ListIdentifiers/{*}header/{*}identifier"):
+            identifiers.add(identifier.text)
+        token = root.findtext("{*}ListIdentifiers/{*}resumptionToken")
+        if not token:
+            return identifiers
+        URL = f"{endpoint}?verb=ListIdentifiers&resumptionToken={token}"
+
+
+def harvest_superset(key: str, savedir: str, subsets: list=None, membership: str="auto",
+                     controller: RateController=None) -> dict:
+    """
+    Harvests a collection once and writes it, together with the collections that are its subsets (e.g. "erb" and
+    "erb_books", "erb_maps" etc.), to `savedir`/<key>.xml, instead of downloading the records of each subset again.
+
+    The records are assigned to the subsets by the setSpec values of their headers. The identifiers of each
+    subset whose set is not listed in the headers of the first batch are fetched instead with a
+    ListIdentifiers pass, which only transfers the record headers. The files of the subsets are written in the same form as by
+    harvest_oai, with the request element of the subset. The files are written as <name>.xml.part and only
+    replace the previous harvests once the whole pass has succeeded.
+
+    Args:
+        key (str): The key of the superset to harvest, e.g. "erb".
+        savedir (str): The directory of the harvested files.
+        subsets (list, optional): The keys of the subsets to write. By default, all collections with `key`
+            as their "superset" (see oai_collections.collections).
+        membership (str, optional): "headers" to assign the records by the setSpec values of their headers,
+            "identifiers" to assign them by ListIdentifiers passes, or "auto" (default) to decide for each
+            subset whether its set is listed in the headers of the first batch.
+        controller (RateController, optional): The rate controller for the requests (see get_collection).
+
+    Returns:
+        dict: The number of records written for the superset and each subset.
+
+    Example:
+        >>> harvest_superset("erb", "data")
+        {'erb': 412301, 'erb_books': 164388, 'erb_public_domain': 98251, ...}
+    """
+    if membership not in ["auto", "headers", "identifiers"]:
+        raise ValueError(f"Unknown membership: {membership}. Must be one of ['auto', 'headers', 'identifiers'].")
+    if controller is None:
+        controller = RateController()
+    if subsets is None:
+        subsets = subsets_of(key)
+    specs = {subset: set_spec(collections[subset]["OAI-PMH"]) for subset in subsets}
+    paths = {name: os.path.join(savedir, f"{name}.xml") for name in [key] + subsets}
+    writers = {name: OAIWriter(path + ".part") for name, path in paths.items()}
+    methods = None
+    subset_identifiers = {}
+    try:
+        for ListRecords, request_metadata in iter_batches(collections[key]["OAI-PMH"], controller=controller):
+            record_specs = [set(record_sets(record)) for record in ListRecords]
+            if methods is None:
+                # decide per subset: a subset whose set is not listed in the headers of the first batch
+                # (which may be only because the headers do not list it) gets a ListIdentifiers pass
+                header_specs = set().union(*record_specs)
+                methods = {subset: membership if membership != "auto"
+                           else "headers" if specs[subset] in header_specs else "identifiers"
+                           for subset in subsets}
+                for subset in subsets:
+                    if methods[subset] == "identifiers":
+                        print(f"Listing the identifiers of {collections[subset]['title']}")
+                        subset_identifiers[subset] = list_identifiers(collections[subset]["OAI-PMH"], controller=controller)
+            if subset_identifiers:
+                record_ids = [record.findtext("{*}header/{*}identifier") for record in ListRecords]
+
+            # serialize each record once, however many files it is written to
+            serialized = [etree.tostring(record, encoding="utf8", pretty_print=True, with_tail=False).decode()
+                          for record in ListRecords]
+            writers[key].write_serialized(serialized, request_metadata)
+            for subset in subsets:
+                if methods[subset] == "headers":
+                    selected = [entry for entry, record_spec in zip(serialized, record_specs) if specs[subset] in record_spec]
+                else:
+                    selected = [entry for entry, identifier in zip(serialized, record_ids)
+                                if identifier in subset_identifiers[subset]]
+                metadata = request_metadata
+                if not writers[subset].started:
+                    # the subset file gets the request of the subset, as if it had been harvested on its own
+                    request = copy.deepcopy(request_metadata["request"])
+                    if request.get("set") is not None:
+                        request.set("set", specs[subset])
+                    metadata = {**request_metadata, "request": request}
+                writers[subset].write_serialized(selected, metadata)
+    except BaseException:
+        # keep the previous harvests and drop the partial files
+        for writer in writers.values():
+            writer.close()
+            if os.path.exists(writer.path):
+                os.remove(writer.path)
+        raise
+    for name, writer in writers.items():
+        writer.close()
+        os.replace(writer.path, paths[name])
+    for subset in subsets:
+        if writers[subset].n_records == 0 and writers[key].n_records > 0:
+            print(f"Warning: no records were assigned to {subset} (set {specs[subset]}). If its records are "
+                  f"not listed in the headers, harvest it with membership=\"identifiers\" or on its own.")
+    return {name: writer.n_records for name, writer in writers.items()}
@@ -0,0 +1,161 @@
+# The collection registry has no third-party imports, so that listing the
+# available collections (e.g. `python cli.py list`) stays cheap.
+# The sets that are subsets of another collection name it as their "superset", so that a full
+# mirror can harvest the superset once and split it locally (see harvester.harvest_superset).
+collections = {
+    "erb": {
+        "title": "ERB - Estonian National Bibliography",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=erb&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML"
+    },
+    "erb_books": {
+        "title": "ERB - Estonian books",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=raamat&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML",
+        "superset": "erb"
+    },
+    "erb_public_domain": {
+        "title": "ERB - works in public domain",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=vabakasutus&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML",
+        "superset": "erb"
+    },
+    "erb_non_estonian": {
+        "title": "ERB - foreign language books",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=muukeelne&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML",
+        "superset": "erb"
+    },
+    "erb_graphics": {
+        "title": "ERB - graphic material",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=piltteavikud&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML",
+        "superset": "erb"
+    },
+    "erb_maps": {
+        "title": "ERB - maps",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=kaardid&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML",
+        "superset": "erb"
+    },
+    "erb_multimedia": {
+        "title": "ERB - multimedia",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=multimeedia&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML",
+        "superset": "erb"
+    },
+    "erb_periodicals": {
+        "title": "ERB - periodicals",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=perioodika&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML",
+        "superset": "erb"
+    },
+    "erb_sheetmusic": {
+        "title": "ERB - sheet music",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=noodid&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML",
+        "superset": "erb"
+    },
+    "erb_soundrecordings": {
+        "title": "ERB - sound recordings",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=helisalvestised&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML",
+        "superset": "erb"
+    },
+    "erb_video": {
+        "title": "ERB - video",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=video&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML",
+        "superset": "erb"
+    },
+    "nle_digar": {
+        "title": "DIGAR - digital archive",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=digar&metadataPrefix=edm",
+        "original_format": "Europeana Data Model"
+    },
+    "nle_eodopen": {
+        "title": "DIGAR - EODOPEN collection",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=eodopen&metadataPrefix=marc21xml",
+        "original_format": "Europeana Data Model"
+    },
+    "nle_books": {
+        "title": "DIGAR - books",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=book&metadataPrefix=edm",
+        "original_format": "Europeana Data Model"
+    },
+    "nle_journals": {
+        "title": "DIGAR - journals",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=journal&metadataPrefix=edm",
+        "original_format": "Europeana Data Model"
+    },
+    "nle_maps": {
+        "title": "DIGAR - maps",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=map&metadataPrefix=edm",
+        "original_format": "Europeana Data Model"
+    },
+    "nle_postcards": {
+        "title": "DIGAR - postcards",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=postcard&metadataPrefix=edm",
+        "original_format": "Europeana Data Model"
+    },
+    "nle_posters": {
+        "title": "DIGAR - posters",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=poster&metadataPrefix=edm",
+        "original_format": "Europeana Data Model"
+    },
+    "nle_samplebooks": {
+        "title": "DIGAR - books sample",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=sample_book&metadataPrefix=edm",
+        "original_format": "Europeana Data Model"
+    },
+    "nle_serials": {
+        "title": "DIGAR - serials",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=serials&metadataPrefix=edm",
+        "original_format": "Europeana Data Model"
+    },
+    "nle_sheetmusic": {
+        "title": "DIGAR - sheet music",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=sheet_music&metadataPrefix=edm",
+        "original_format": "Europeana Data Model"
+    },
+    "nle_soundrecordings": {
+        "title": "DIGAR - sound recordings",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=soundrecording&metadataPrefix=edm",
+        "original_format": "Europeana Data Model"
+    },
+    "nle_standards": {
+        "title": "DIGAR - standards",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=standard&metadataPrefix=edm",
+        "original_format": "Europeana Data Model"
+    },
+    "nle_persons": {
+        "title": "Person names",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=person&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML"
+    },
+    "nle_organisations": {
+        "title": "Organisation names",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=organization&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML"
+    },
+    "ise_bie": {
+        "title": "Estonian Legal Bibliography",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=bie&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML"
+    },
+    "ise_parliamentarism": {
+        "title": "Parliamentarism",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=parlamentism&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML"
+    },
+    "ise_vpb": {
+        "title": "Bibliography - Presidents of Estonia",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=vpb&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML"
+    },
+    "ise_repros": {
+        "title": "Reproductions",
+        "OAI-PMH": "https://data.digar.ee/repox/OAIHandler?verb=ListRecords&set=reprod&metadataPrefix=marc21xml",
+        "original_format": "MARC21XML"
+    }
+}
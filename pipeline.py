@@ -0,0 +1,281 @@
+"""
+Streaming harvest-to-convert pipeline: the harvested batches flow through bounded queues straight into the
+record parsers and a sink (Parquet, JSONL or the SQLite catalog), without writing and re-reading the
+OAI-PMH XML file.
+
+    harvester threads --(batches)--> parser --(parsed records)--> writer thread --> sink (+ optional XML archive)
+
+The network requests, the parsing and the writing overlap, and the bounded queues keep the memory use
+independent of the collection size.
+"""
+import json
+import queue
+import threading
+from urllib.parse import urlparse, parse_qs
+
+from lxml import etree
+
+from harvester import iter_batches, OAIWriter
+from oai_collections import collections
+from converter import (MARCrecordParser, DCrecordParser, EDMrecordParser, marc_record_from_element, resolve_marc_fields,
+                       marc_columns_dict, get_namespaces)
+from columnar import ColumnBuffers, import_backend
+
+
+def parse_harvested_record(record: etree._Element, fields: list=None, multivalue: str="join", full_edm: bool=False,
+                           control_fields: bool=False, edm_deletions: bool=False):
+    """
+    Parses a harvested OAI-PMH record element into an (identifier, format, record) tuple, as in
+    catalog.iter_catalog_records: MARC records are flattened with MARCrecordParser (with the field codes as
+    keys) and keyed on their 001 control number, EDM records are parsed with DCrecordParser (or EDMrecordParser,
+    if `full_edm`) and keyed on the OAI identifier. Only the given `fields` are extracted, and repeated values are joined or returned as lists
+    according to `multivalue` (see oai_to_dataframe). The fixed-length control fields (006, 007, 008) are kept if `control_fields`.
+    Returns None for deleted records, which have no metadata, or (identifier, "edm", None) if `edm_deletions`,
+    for the deleted records of an EDM collection (e.g. for CatalogStore.upsert to remove them).
+    """
+    ns = get_namespaces()
+    identifier = record.findtext("{%s}header/{%s}identifier" % (ns["oai"], ns["oai"]))
+    metadata = record.find("{%s}metadata" % ns["oai"])
+    if metadata is None or len(metadata) == 0:
+        header = record.find("{%s}header" % ns["oai"])
+        if edm_deletions and identifier and header is not None and header.get("status") == "deleted":
+            return identifier.strip(), "edm", None
+        return None
+    if metadata[0].tag == "{%s}record" % ns["marc"]:
+        paths = resolve_marc_fields(fields) if fields is not None else None
+        tags = {path.split("$")[0] for path in paths} if paths is not None else None
+        marc_record = marc_record_from_element(metadata[0], tags=tags)
+        control_numbers = marc_record.get_fields("001")
+        if control_numbers and control_numbers[0].data:
+            identifier = control_numbers[0].data.strip()
+        return identifier, "marc", MARCrecordParser(marc_record, paths=paths, multivalue=multivalue,
+                                                       control_fields=control_fields).parse()
+    else:
+        projection = set(fields) if fields is not None else None
+        parser = EDMrecordParser if full_edm else DCrecordParser
+        return identifier, "edm", parser(record, projection=projection, multivalue=multivalue).parse()
+
+
+class JSONLSink():
+    """Writes the records as JSON lines, with the record identifier under "id"."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "w", encoding="utf8")
+
+    def write(self, records: list):
+        for identifier, _, record in records:
+            self.file.write(json.dumps({"id": identifier, **record}, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink():
+    """
+    Writes the records to a Parquet file, one row group per harvested batch. As the columns of a streamed
+    collection are not known in advance, the records are conformed to the unified schema of the partitioned
+    dataset (see dataset.unified_schema): the informative MARC column names and the Dublin Core fields, with
+    the language-tagged Dublin Core fields folded into their base columns (see dataset.conform_table).
+    With multivalue="list", the columns are lists (stream_collection parses the records in the `multivalue`
+    mode of the sink). Parse the MARC records with control_fields=True to fall back to the 008 field for the
+    publication year.
+    Needs the pyarrow package.
+    """
+
+    def __init__(self, path: str, collection: str=None, multivalue: str="join"):
+        from dataset import unified_schema
+
+        import_backend("arrow")
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self.collection = collection
+        self.multivalue = multivalue
+        self.schema = unified_schema(multivalue)
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, records: list):
+        from dataset import conform_table
+
+        buffers = ColumnBuffers()
+        for _, format, record in records:
+            buffers.append(record)
+        if buffers.n_rows == 0:
+            return
+        table = buffers.to_arrow(columns_dict=marc_columns_dict if records[0][1] == "marc" else None)
+        self.writer.write_table(conform_table(table, self.schema, self.collection, verbose=False))
+
+    def close(self):
+        self.writer.close()
+
+
+class CatalogSink():
+    """
+    Upserts the records into a catalog.CatalogStore database. The database is opened on the first write,
+    as an SQLite connection can only be used in the thread that opened it.
+
+    As with CatalogStore.ingest, the records are parsed with multivalue="list" (so that e.g. each ISBN is
+    indexed on its own), and the deleted records of EDM collections are removed from the catalog.
+    """
+    multivalue = "list"
+    edm_deletions = True
+
+    def __init__(self, path: str, collection: str=None):
+        self.path = path
+        self.collection = collection
+        self.store = None
+
+    def write(self, records: list):
+        if self.store is None:
+            from catalog import CatalogStore
+
+            self.store = CatalogStore(self.path)
+        self.store.upsert(records, collection=self.collection)
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+
+class XMLArchive(OAIWriter):
+    """Writes the raw harvested records to an OAI-PMH XML file, in the same form as harvester.write_records."""
+
+
+sinks = {"parquet": ParquetSink, "jsonl": JSONLSink, "catalog": CatalogSink}
+
+
+class PipelineStopped(Exception):
+    pass
+
+
+def put(q: queue.Queue, item, stop: threading.Event):
+    """Puts an item into a bounded queue, unless the pipeline is stopped while waiting for a free slot."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+    raise PipelineStopped()
+
+
+def stream_collection(key: str, sink, archive_path: str=None, fields: list=None, controller=None,
+                      queue_size: int=8, multivalue: str="join", full_edm: bool=False, control_fields: bool=False) -> dict:
+    """
+    Harvests a collection and converts it on the fly: the harvested batches are parsed as soon as they arrive
+    and written to `sink`, without the intermediate OAI-PMH XML file (unless `archive_path` is given).
+
+    The harvester (see harvester.iter_batches), the parser and the writer run in separate threads connected by
+    bounded queues of `queue_size` batches, so that the network, the parsing and the writing overlap, and a slow
+    stage holds back the others instead of filling the memory. The parsed records are the same as those of
+    oai_to_dataframe before the DataFrame is built.
+
+    Args:
+        key (str): The key of the collection to harvest (see oai_collections.collections).
+        sink: An object with write(records) and close() methods, where `records` is a list of
+            (identifier, format, record) tuples, e.g. JSONLSink, ParquetSink or CatalogSink.
+            The sink is closed at the end of the harvest.
+        archive_path (str, optional): If given, the raw records are also written to this OAI-PMH XML file.
+        fields (list, optional): Only extract these fields (see oai_to_dataframe).
+        controller (RateController, optional): The rate controller for the requests (see harvester.get_collection).
+        queue_size (int, optional): The number of batches each queue can hold (default=8).
+        multivalue (str, optional): "join" (default) or "list" (see oai_to_dataframe). A sink with a
+            `multivalue` attribute (ParquetSink, CatalogSink) is given records in its own mode instead.
+        full_edm (bool, optional): Extract the full set of EDM properties (see oai_to_dataframe).
+        control_fields (bool, optional): Keep the fixed-length control fields of the MARC records (see
+            oai_to_dataframe), e.g. for the publication years of a ParquetSink.
+
+    Returns:
+        dict: The number of harvested batches and records, and of the records written to the sink.
+
+    Example:
+        >>> stream_collection("erb_books", ParquetSink("data/erb_books.parquet", collection="erb_books"),
+        ...                   control_fields=True)
+        >>> stream_collection("nle_books", CatalogSink("data/catalog.db", collection="nle_books"),
+        ...                   archive_path="data/nle_books.xml")
+    """
+    URL = collections[key]["OAI-PMH"]
+    multivalue = getattr(sink, "multivalue", multivalue)
+    # a sink with `edm_deletions` (CatalogSink) also gets the deleted records of EDM collections
+    is_edm = parse_qs(urlparse(URL).query).get("metadataPrefix") == ["edm"]
+    edm_deletions = getattr(sink, "edm_deletions", False) and is_edm
+
+    batches = queue.Queue(maxsize=queue_size)
+    parsed = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    counts = {"batches": 0, "records": 0, "written": 0}
+    done = object()
+
+    def harvest():
+        harvested = iter_batches(URL, controller=controller)
+        try:
+            for records, metadata in harvested:
+                put(batches, (records, metadata), stop)
+            put(batches, done, stop)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            # cancel the batches requested ahead
+            harvested.close()
+
+    def write():
+        archive = XMLArchive(archive_path) if archive_path is not None else None
+        try:
+            while not stop.is_set():
+                try:
+                    item = parsed.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is done:
+                    break
+                raw_records, metadata, records = item
+                if archive is not None:
+                    archive.write(raw_records, metadata)
+                sink.write(records)
+                counts["written"] += len(records)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            if archive is not None:
+                archive.close()
+            sink.close()
+
+    harvester_thread = threading.Thread(target=harvest, daemon=True)
+    writer_thread = threading.Thread(target=write, daemon=True)
+    harvester_thread.start()
+    writer_thread.start()
+    try:
+        while not stop.is_set():
+            try:
+                item = batches.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is done:
+                put(parsed, done, stop)
+                break
+            raw_records, metadata = item
+            records = [parse_harvested_record(record, fields=fields, multivalue=multivalue, full_edm=full_edm,
+                                              control_fields=control_fields, edm_deletions=edm_deletions)
+                       for record in raw_records]
+            records = [record for record in records if record is not None]
+            counts["batches"] += 1
+            counts["records"] += len(raw_records)
+            put(parsed, (raw_records, metadata, records), stop)
+    except PipelineStopped:
+        pass
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        writer_thread.join()
+        stop.set()
+        harvester_thread.join()
+    if errors:
+        raise errors[0]
+    return counts
@@ -0,0 +1,285 @@
+"""
+Profiling of harvested files: record counts, field population rates, approximate distinct counts,
+most common values and date ranges, collected in one streaming pass over the XML without building
+pymarc Records, dictionaries or DataFrames, and with bounded memory per field.
+
+(The module is not called `profile`, so that it does not shadow the profile module of the standard library.)
+"""
+import math
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+from lxml import etree
+
+from converter import (MARC_XML_NS, free_element, get_namespaces, dc_fields_xpath, identifier_column, extract_year,
+                       publication_year, marc_columns_dict)
+
+
+class HyperLogLog():
+    """
+    Estimates the number of distinct values of a stream in a fixed amount of memory (2^precision registers),
+    with a relative error of about 1.04 / sqrt(2^precision), i.e. 1.6% with the default precision.
+
+    The values are hashed with the built-in hash(), so they should be strings (the hash of a small integer
+    is the integer itself), and the estimates of different processes can not be merged.
+    """
+
+    def __init__(self, precision: int=12):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+        self.rank_bits = 64 - precision
+
+    def update(self, values: list):
+        """Adds a batch of values (hashed and merged into the registers with numpy)."""
+        hashes = np.fromiter(map(hash, values), dtype=np.int64, count=len(values)).view(np.uint64)
+        index = (hashes >> np.uint64(self.rank_bits)).astype(np.intp)
+        rest = hashes & np.uint64((1 << self.rank_bits) - 1)
+        # the position of the first 1 bit of the remaining bits (the exponent of frexp is the bit length)
+        rank = self.rank_bits + 1 - np.frexp(rest.astype(np.float64))[1]
+        np.maximum.at(self.registers, index, np.clip(rank, 1, self.rank_bits + 1).astype(np.uint8))
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.m and zeros > 0:
+            # small cardinalities: linear counting of the empty registers
+            return round(self.m * math.log(self.m / zeros))
+        return round(estimate)
+
+
+class TopK():
+    """
+    Finds the most common values of a stream with at most `capacity` counters (the mergeable version of
+    the Misra-Gries algorithm). Every value that occurs more than n / (capacity + 1) times is kept;
+    the counts are lower bounds, at most n / (capacity + 1) below the true counts.
+    """
+
+    def __init__(self, capacity: int=1000):
+        self.capacity = capacity
+        self.counters = Counter()
+
+    def update(self, counts: Counter):
+        """Adds the counts of a batch of values, e.g. Counter(values)."""
+        self.counters.update(counts)
+        if len(self.counters) > self.capacity:
+            # subtract the (capacity+1)-th largest count from all counters, and drop those that reach zero
+            threshold = sorted(self.counters.values(), reverse=True)[self.capacity]
+            self.counters = Counter({value: count - threshold for value, count in self.counters.items()
+                                     if count > threshold})
+
+    def most_common(self, k: int=10) -> list:
+        return self.counters.most_common(k)
+
+
+class FieldProfile():
+    """The statistics of one field: the records and values it occurs in, and its distinct and most common values."""
+
+    def __init__(self, precision: int=12, capacity: int=1000):
+        self.records = 0
+        self.values = 0
+        self.distinct = HyperLogLog(precision)
+        self.top = TopK(capacity)
+
+    def update(self, values: list):
+        self.values += len(values)
+        self.distinct.update(values)
+        self.top.update(Counter(values))
+
+
+class Range():
+    """The smallest and largest of a stream of comparable values."""
+
+    def __init__(self):
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        if value is None:
+            return
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+
+def marc_field_values(record: etree._Element) -> list:
+    """
+    Returns the (path, value) pairs of a MARC record element with the same paths as MARCrecordParser
+    (e.g. "001", "245$a"; "100", "600" and "700" for the person fields, with the name as their value),
+    but with the raw values, and without building a pymarc Record.
+    """
+    controlfield = "{%s}controlfield" % MARC_XML_NS
+    datafield = "{%s}datafield" % MARC_XML_NS
+    values = []
+    for field in record:
+        tag = field.get("tag")
+        if tag is None or tag[0] == "9":
+            continue
+        # as in marc_record_from_element, missing values are empty strings (and count as present)
+        if field.tag == controlfield:
+            if tag not in ["006", "007", "008"]:
+                values.append((tag, field.text or ""))
+        elif field.tag == datafield:
+            if tag in ["100", "600", "700"]:
+                values.append((tag, next((subfield.text or "" for subfield in field if subfield.get("code") == "a"), "")))
+            else:
+                prefix = tag + "$"
+                values += [(prefix + subfield.get("code", ""), subfield.text or "") for subfield in field]
+    return values
+
+
+marc_fixed_xpath = etree.XPath("marc:controlfield[@tag='008']/text()", namespaces={"marc": MARC_XML_NS})
+
+
+def marc_year(record: etree._Element, values: list):
+    """
+    The publication year of a MARC record element (see converter.publication_year), from the first 260$c
+    and 264$c of its `values` (see marc_field_values) or else from its 008 field.
+    """
+    dates = [next((value for value_path, value in values if value_path == path), None) for path in ["260$c", "264$c"]]
+    year = publication_year(dates)
+    if year is None:
+        fixed = marc_fixed_xpath(record)
+        year = publication_year([], fixed[0] if fixed else None)
+    return year
+
+
+def dc_field_values(record: etree._Element) -> list:
+    """
+    Returns the (field, value) pairs of an EDM record element with the same field names as DCrecordParser
+    (e.g. "title", "title_et", "isbn", "year").
+    """
+    values = []
+    for field in dc_fields_xpath(record):
+        text = field.text
+        if text is None:
+            continue
+        tag = field.tag.rsplit("}", 1)[1]
+        if tag == "identifier":
+            tag = identifier_column(text)
+        elif tag == "date":
+            year = extract_year(text)
+            if year is not None:
+                values.append(("year", str(year)))
+        lang = field.get("{http://www.w3.org/XML/1998/namespace}lang")
+        if lang is not None:
+            tag = tag + "_" + lang
+        values.append((tag, text))
+    return values
+
+
+def profile(filepath: str, top_k: int=10, precision: int=12, capacity: int=1000, batch_size: int=1000) -> dict:
+    """
+    Collects the statistics of a harvested OAI-PMH file (or a MARCXML collection) in one streaming pass,
+    without building records or DataFrames: the number of records, the population rate of each field
+    (the share of records that have it, as the `column_population` of marc_to_dataframe; as in the converted
+    tables, deleted records are counted as records without fields), the number of
+    values, the approximate number of distinct values and the most common values of each field, and
+    the range of the publication years and of the OAI datestamps.
+
+    The fields are named as in the converted tables with the field codes kept (e.g. "245$a", "title_et"),
+    but the values are the raw values of the XML, before the cleaning of the converter. The distinct counts
+    are HyperLogLog estimates and the most common values are found with `capacity` counters per field,
+    so that the memory use does not grow with the size of the file. The values are collected for
+    `batch_size` records at a time and added to these sketches in bulk.
+
+    Args:
+        filepath (str): The path to the harvested XML file.
+        top_k (int, optional): The number of most common values reported per field (default=10).
+        precision (int, optional): The HyperLogLog precision; the distinct counts have a relative error of
+            about 1.04 / sqrt(2^precision) (default=12, i.e. 1.6%).
+        capacity (int, optional): The number of counters per field for finding the most common values (default=1000).
+        batch_size (int, optional): The number of records whose values are added to the sketches at once (default=1000).
+
+    Returns:
+        dict: The statistics, with the keys "format", "records", "deleted", "years" and "datestamps"
+            (as (min, max) tuples) and "fields", which maps each field to its "name" (the informative
+            MARC column name, or the field itself), "population", "records", "values", "distinct" and "top".
+
+    Example:
+        >>> stats = profile("data/erb_books.xml")
+        >>> stats["records"], stats["years"]
+        (164388, (1535, 2023))
+        >>> stats["fields"]["245$a"]["population"], stats["fields"]["041$a"]["top"][:2]
+        (1.0, [('est', 150923), ('rus', 5710)])
+    """
+    ns = get_namespaces()
+    oai_record = "{%s}record" % ns["oai"]
+    oai_header = "{%s}header" % ns["oai"]
+    oai_metadata = "{%s}metadata" % ns["oai"]
+    marc_record = "{%s}record" % MARC_XML_NS
+
+    fields = {}
+    population = Counter()
+    batch = []
+    counts = {"records": 0, "deleted": 0}
+    years = Range()
+    datestamps = Range()
+    format = None
+
+    def add_batch():
+        # group the (path, value) pairs of the batch by path
+        batch.sort(key=itemgetter(0))
+        for path, pairs in groupby(batch, key=itemgetter(0)):
+            if path not in fields:
+                fields[path] = FieldProfile(precision, capacity)
+            fields[path].update([value for _, value in pairs])
+        batch.clear()
+
+    def add_record(values: list):
+        batch.extend(values)
+        population.update({path for path, _ in values})
+        counts["records"] += 1
+        if counts["records"] % batch_size == 0:
+            add_batch()
+
+    for _, element in etree.iterparse(filepath, events=("end",), tag=[oai_record, marc_record]):
+        parent = element.getparent()
+        if element.tag == marc_record:
+            format = "marc"
+            values = marc_field_values(element)
+            add_record(values)
+            years.add(marc_year(element, values))
+            if parent is not None and parent.tag == oai_metadata:
+                # the OAI-PMH record is finished (and freed) with its header below
+                element.clear()
+                continue
+        else:
+            header = element.find(oai_header)
+            if header is not None:
+                datestamps.add(header.findtext("{%s}datestamp" % ns["oai"]))
+                if header.get("status") == "deleted":
+                    counts["deleted"] += 1
+            metadata = element.find(oai_metadata)
+            if metadata is None or len(metadata) == 0:
+                # a deleted record is an empty row of the converted table, so it counts in the population rates
+                add_record([])
+            elif metadata[0].tag != marc_record:
+                format = "edm"
+                values = dc_field_values(element)
+                add_record(values)
+                year = next((value for path, value in values if path == "year"), None)
+                years.add(int(year) if year is not None else None)
+        free_element(element)
+
+    add_batch()
+
+    n_records = counts["records"]
+    for path, field in fields.items():
+        field.records = population[path]
+    return {"format": format,
+            "records": n_records,
+            "deleted": counts["deleted"],
+            "years": (years.min, years.max),
+            "datestamps": (datestamps.min, datestamps.max),
+            "fields": {path: {"name": marc_columns_dict.get(path, path) if format == "marc" else path,
+                              "population": field.records / max(n_records, 1),
+                              "records": field.records,
+                              "values": field.values,
+                              "distinct": field.distinct.count(),
+                              "top": field.top.most_common(top_k)}
+                       for path, field in sorted(fields.items(), key=lambda item: -item[1].records)}}
@@ -0,0 +1,200 @@
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+def parse_retry_after(value: str):
+    """
+    Parses the value of a Retry-After header (a number of seconds or an HTTP date) into seconds,
+    or returns None if it is missing or invalid.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class RateController():
+    """
+    An AIMD (additive increase, multiplicative decrease) controller for the number of concurrent requests
+    to an OAI-PMH endpoint, in the manner of TCP congestion control.
+
+    Every successful request with a normal response time raises the concurrency window by about
+    `increase_step` per window's worth of requests. The window is multiplied by `decrease_factor` (at most
+    once per round-trip time) when the server signals overload: a 429 or 503 response, a connection error
+    or timeout, or a response time above the latency target. After 429/503 responses no new requests are
+    started until the Retry-After delay (or an exponential backoff) has passed.
+
+    By default, the latency target is relative to a baseline response time that follows faster responses
+    at once and slower ones gradually, so that a slow drift that is not caused by the load (e.g. an endpoint
+    whose offset cursors get slower deeper into a collection) does not shrink the window, while a sudden
+    slowdown after an increase does.
+
+    The controller is thread-safe: each request is wrapped in acquire() and release(), and acquire()
+    blocks while the window is full or a backoff is in effect.
+
+    Args:
+        initial_concurrency (int, optional): The initial window (default=1).
+        min_concurrency (int, optional): The smallest window (default=1).
+        max_concurrency (int, optional): The largest window (default=4).
+        target_latency (float, optional): The response time (in seconds) above which the window is decreased.
+            By default, `latency_tolerance` times the baseline response time.
+        latency_tolerance (float, optional): See `target_latency` (default=3.0).
+        baseline_growth (float, optional): How fast the baseline response time follows slower responses: it
+            grows by at most this fraction per response (default=0.02).
+        increase_step (float, optional): The additive increase per window (default=1).
+        decrease_factor (float, optional): The multiplicative decrease (default=0.5).
+        backoff (float, optional): The initial pause (in seconds) after a 429/503 response without
+            Retry-After or after an error; it doubles with each consecutive failure (default=1).
+        max_backoff (float, optional): The longest of these pauses (default=60). The Retry-After delays
+            of the server are kept as they are, however long.
+
+    Attributes:
+        concurrency (float): The current window; int(concurrency) requests may be in flight.
+        in_flight (int): The number of requests currently in flight.
+        latency (float): The exponentially weighted moving average of the response times.
+        baseline_latency (float): The baseline response time (see `baseline_growth`).
+        counters (dict): The number of requests, successes, throttled responses, errors, window increases
+            and decreases, and the total time spent in backoff.
+        decisions (list): The changes of the window, as (time, reason, concurrency) tuples.
+
+    Methods:
+        acquire():
+            Waits for a free slot in the window.
+
+        release():
+            Frees the slot of a finished request.
+
+        on_success(latency):
+            Records a successful response and its response time.
+
+        on_throttle(retry_after):
+            Records a 429/503 response.
+
+        on_error():
+            Records a failed request (connection error, timeout, server error).
+
+        metrics():
+            Returns a snapshot of the controller state.
+    """
+
+    def __init__(self, initial_concurrency: int=1, min_concurrency: int=1, max_concurrency: int=4,
+                 target_latency: float=None, latency_tolerance: float=3.0, baseline_growth: float=0.02, increase_step: float=1,
+                 decrease_factor: float=0.5, backoff: float=1, max_backoff: float=60):
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.target_latency = target_latency
+        self.latency_tolerance = latency_tolerance
+        self.baseline_growth = baseline_growth
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.initial_backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.in_flight = 0
+        self.latency = None
+        self.baseline_latency = None
+        self.backoff = backoff
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.counters = {"requests": 0, "successes": 0, "throttled": 0, "errors": 0,
+                         "increases": 0, "decreases": 0, "backoff_seconds": 0.0}
+        self.decisions = []
+        self.start_time = time.monotonic()
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.concurrency):
+                    break
+                self.condition.wait(timeout=wait if wait > 0 else None)
+            self.in_flight += 1
+            self.counters["requests"] += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def latency_limit(self):
+        if self.target_latency is not None:
+            return self.target_latency
+        if self.baseline_latency is None:
+            return None
+        return self.baseline_latency * self.latency_tolerance
+
+    def on_success(self, latency: float):
+        with self.condition:
+            self.counters["successes"] += 1
+            self.backoff = self.initial_backoff
+            if self.baseline_latency is None:
+                self.baseline_latency = latency
+            else:
+                self.baseline_latency = min(latency, self.baseline_latency * (1 + self.baseline_growth))
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            limit = self.latency_limit()
+            if limit is not None and self.latency > limit:
+                self.decrease("latency")
+            elif self.concurrency < self.max_concurrency:
+                # about +increase_step per window's worth of successful requests
+                window = int(self.concurrency)
+                self.concurrency = min(self.max_concurrency, self.concurrency + self.increase_step / self.concurrency)
+                if int(self.concurrency) > window:
+                    self.counters["increases"] += 1
+                    self.record_decision("increase")
+            self.condition.notify_all()
+
+    def on_throttle(self, retry_after: float=None):
+        with self.condition:
+            self.counters["throttled"] += 1
+            self.decrease("throttled")
+            self.pause(retry_after)
+
+    def on_error(self):
+        with self.condition:
+            self.counters["errors"] += 1
+            self.decrease("error")
+            self.pause(None)
+
+    def decrease(self, reason: str):
+        # react at most once per round-trip time, as the requests already in flight were sent with the old window
+        now = time.monotonic()
+        if now - self.last_decrease < (self.latency or 0):
+            return
+        self.last_decrease = now
+        self.concurrency = max(self.min_concurrency, self.concurrency * self.decrease_factor)
+        self.counters["decreases"] += 1
+        self.record_decision(reason)
+
+    def pause(self, retry_after: float):
+        # the server's Retry-After is honoured as sent; only our own backoff is capped
+        if retry_after is None:
+            retry_after = min(self.backoff, self.max_backoff)
+            self.backoff = min(self.max_backoff, self.backoff * 2)
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        self.counters["backoff_seconds"] += retry_after
+
+    def record_decision(self, reason: str):
+        self.decisions.append((round(time.monotonic() - self.start_time, 3), reason, round(self.concurrency, 2)))
+
+    def metrics(self) -> dict:
+        with self.condition:
+            elapsed = time.monotonic() - self.start_time
+            return {"concurrency": round(self.concurrency, 2),
+                    "in_flight": self.in_flight,
+                    "latency": self.latency,
+                    "baseline_latency": self.baseline_latency,
+                    "requests_per_second": self.counters["successes"] / elapsed if elapsed > 0 else 0.0,
+                    **self.counters}
@@ -0,0 +1,181 @@
+import mmap
+import os
+import re
+from array import array
+from bisect import bisect_right
+
+from lxml import etree
+
+
+def tag_pattern(tag: str):
+    """The local name of the record elements, followed by the end of the name."""
+    return re.compile(re.escape(tag.encode()) + rb"(?=[\s/>])")
+
+
+# what may stand between "<" and the local name of a tag: a slash (end tag) and a namespace prefix
+tag_start_pattern = re.compile(rb"(/?)(?:[A-Za-z_][\w.-]*:)?")
+
+
+# the namespace declarations of the root element, which the record slices may rely on
+namespace_pattern = re.compile(rb"""\sxmlns(?::[\w.-]+)?\s*=\s*(?:"[^"]*"|'[^']*')""")
+
+
+class RecordScanner():
+    """
+    Finds the byte ranges of the records of a large XML file without parsing it, by scanning the raw bytes
+    of the memory-mapped file for the start and end tags of the records.
+
+    Only the outermost elements with the given local name are records, so that OAI-PMH records with an
+    embedded MARC <record> are found once, as a whole. The records are exposed as zero-copy memoryview
+    slices of the mapped file, which can be parsed one by one or handed to other processes as (start, end)
+    offsets. The scanner does not check well-formedness; tags inside comments or CDATA sections are not
+    told apart from real tags.
+
+    Args:
+        filepath (str): The path to the XML file (e.g. a harvested OAI-PMH file, or a MARCXML collection).
+        tag (str, optional): The local name of the record elements (default="record").
+
+    Attributes:
+        filepath (str): The path to the XML file.
+        starts (array): The byte offsets at which the records start.
+        ends (array): The byte offsets at which the records end (exclusive).
+        namespaces (bytes): The namespace declarations of the root element.
+
+    Methods:
+        parse(i):
+            Parses the i-th record into an lxml element.
+
+        partitions(n):
+            Splits the records into n contiguous (first, last) index ranges of about the same size in bytes.
+
+    Example:
+        >>> with RecordScanner("data/erb_books.xml") as scanner:
+        ...     print(len(scanner), scanner.starts[0], scanner.ends[0])
+        ...     raw = bytes(scanner[0])
+        ...     record = scanner.parse(0)
+    """
+
+    def __init__(self, filepath: str, tag: str="record"):
+        self.filepath = filepath
+        self.starts = array("q")
+        self.ends = array("q")
+        self.namespaces = b""
+        self.mmap = None
+        self.view = None
+        self.file = open(filepath, "rb")
+        try:
+            # an empty file can not be memory-mapped
+            if os.fstat(self.file.fileno()).st_size == 0:
+                raise ValueError(f"{filepath} is empty")
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.mmap)
+            self.scan(tag_pattern(tag))
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Closes the file. The record slices can not be used afterwards; if some of them are still referenced,
+        the file stays mapped until they are garbage collected.
+        """
+        if self.view is not None:
+            self.view.release()
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # slices are still exported: the mapping is closed when the last of them is released
+                pass
+        self.file.close()
+
+    def scan(self, pattern):
+        # searching for the literal name is much faster than for "<" (which starts every tag); each match
+        # is then checked to be a start or end tag by looking back for its "<"
+        mm = self.mmap
+        depth = 0
+        for match in pattern.finditer(mm):
+            start_of_tag = mm.rfind(b"<", max(0, match.start() - 256), match.start())
+            if start_of_tag == -1:
+                continue
+            tag_start = tag_start_pattern.fullmatch(mm, start_of_tag + 1, match.start())
+            if tag_start is None:
+                continue
+            end_of_tag = mm.find(b">", match.end())
+            if tag_start.group(1):
+                depth -= 1
+                if depth == 0:
+                    self.ends.append(end_of_tag + 1)
+            elif mm[end_of_tag - 1] == ord("/"):
+                # a self-closing record is empty and does not open a level
+                if depth == 0:
+                    self.starts.append(start_of_tag)
+                    self.ends.append(end_of_tag + 1)
+            else:
+                if depth == 0:
+                    self.starts.append(start_of_tag)
+                depth += 1
+        if len(self.starts) != len(self.ends):
+            raise ValueError(f"{self.filepath} ends inside a record (the file may be truncated)")
+        self.namespaces = self.root_namespaces()
+
+    def root_namespaces(self) -> bytes:
+        """The namespace declarations of the root element (the first start tag that is not the XML declaration)."""
+        position = 0
+        while True:
+            position = self.mmap.find(b"<", position)
+            if position == -1 or (len(self.starts) > 0 and position >= self.starts[0]):
+                return b""
+            if self.mmap[position + 1] not in b"?!":
+                end_of_tag = self.mmap.find(b">", position)
+                return b"".join(namespace_pattern.findall(self.mmap[position:end_of_tag]))
+            position += 1
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i: int) -> memoryview:
+        return self.view[self.starts[i]:self.ends[i]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def parse(self, i: int) -> etree._Element:
+        """
+        Parses the i-th record into an lxml element. The record is parsed within the namespace declarations
+        of the root element, so that it resolves the same prefixes as in the whole file.
+        """
+        return parse_record(self[i], self.namespaces)
+
+    def partitions(self, n: int) -> list:
+        """
+        Splits the records into at most `n` contiguous (first, last) index ranges (`last` exclusive)
+        of about the same size in bytes, e.g. to give each worker process a part of the file.
+        """
+        if len(self) == 0:
+            return []
+        first_byte, total = self.starts[0], self.ends[-1] - self.starts[0]
+        ranges = []
+        first = 0
+        for k in range(1, n + 1):
+            last = len(self) if k == n else bisect_right(self.ends, first_byte + total * k / n)
+            if last > first:
+                ranges.append((first, last))
+                first = last
+        return ranges
+
+
+def parse_record(raw, namespaces: bytes=b"") -> etree._Element:
+    """
+    Parses the raw bytes of a single record (e.g. a RecordScanner slice) into an lxml element,
+    with the given namespace declarations of the enclosing document in scope.
+    """
+    wrapper = etree.fromstring(b"<records" + namespaces + b">" + bytes(raw) + b"</records>")
+    return wrapper[0]
@@ -0,0 +1,127 @@
+"""
+A stand-in OAI-PMH endpoint for testing the harvester without the network: it serves a ListRecords
+collection in batches with repox-style resumptionTokens (see harvester.update_cursor), and can be
+scripted to answer requests with throttling responses (429/503, with or without Retry-After)
+and to respond slowly. It records when each request arrived and how many were in flight.
+"""
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+OAI_NS = "http://www.openarchives.org/OAI/2.0/"
+
+
+class StandInServer():
+    """
+    A local OAI-PMH endpoint running in a background thread.
+
+    Args:
+        n_records (int, optional): The number of records of the collection (default=50).
+        batch_size (int, optional): The number of records per response (default=10).
+        latency (float or callable, optional): The time (in seconds) each response takes (default=0), or a
+            function of the cursor of the requested batch, e.g. for an endpoint that gets slower deeper into
+            the collection regardless of the load.
+        responses (list, optional): Scripted responses for the first requests, as (status, headers) tuples,
+            e.g. [(429, {"Retry-After": "1"}), (503, {})]; None in the list (and every later request)
+            gets the normal response.
+        throttle (callable, optional): Decides the response of each request from the number of requests in
+            flight (including this one): returns a (status, headers) tuple, or None for the normal response.
+
+    Attributes:
+        URL (str): The collection URL, e.g. "http://127.0.0.1:8000/OAIHandler?verb=ListRecords&set=test&metadataPrefix=marc21xml".
+        requests (list): The (arrival time, status, in flight) of each request.
+        max_in_flight (int): The largest number of requests in flight at once.
+    """
+
+    def __init__(self, n_records: int=50, batch_size: int=10, latency: float=0, responses: list=None, throttle=None):
+        self.n_records = n_records
+        self.batch_size = batch_size
+        self.latency = latency
+        self.responses = list(responses or [])
+        self.throttle = throttle
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        host, port = self.httpd.server_address
+        self.endpoint = f"http://{host}:{port}/OAIHandler"
+        self.URL = f"{self.endpoint}?verb=ListRecords&set=test&metadataPrefix=marc21xml"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def arrival_times(self, status: int=None) -> list:
+        """The arrival times of the requests (with the given status), relative to the first request."""
+        start = self.requests[0][0]
+        return [arrival - start for arrival, request_status, _ in self.requests
+                if status is None or request_status == status]
+
+    def handle(self, handler: BaseHTTPRequestHandler):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            in_flight = self.in_flight
+            scripted = self.responses.pop(0) if self.responses else None
+            if scripted is None and self.throttle is not None:
+                scripted = self.throttle(in_flight)
+            self.requests.append((time.monotonic(), scripted[0] if scripted else 200, in_flight))
+        try:
+            cursor = self.cursor(parse_qs(urlparse(handler.path).query))
+            time.sleep(self.latency(cursor) if callable(self.latency) else self.latency)
+            if scripted is not None:
+                status, headers = scripted
+                handler.send_response(status)
+                for name, value in headers.items():
+                    handler.send_header(name, value)
+                handler.send_header("Content-Length", "0")
+                handler.end_headers()
+                return
+            body = self.list_records(cursor)
+            handler.send_response(200)
+            handler.send_header("Content-Type", "text/xml; charset=utf-8")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def cursor(self, query: dict) -> int:
+        if "resumptionToken" in query:
+            return int(query["resumptionToken"][0].strip(":").split(":")[3])
+        return 0
+
+    def list_records(self, cursor: int) -> bytes:
+        records = "".join(f"<record><header><identifier>oai:test:{i}</identifier>"
+                          f"<datestamp>2023-01-01</datestamp><setSpec>test</setSpec></header>"
+                          f"<metadata><dc>record {i}</dc></metadata></record>"
+                          for i in range(cursor, min(cursor + self.batch_size, self.n_records)))
+        # as the repox endpoint, the token holds the cursor of the next batch, and the last batch has an empty token
+        if cursor + self.batch_size < self.n_records:
+            token = f"<resumptionToken>token:test:marc21xml:{cursor + self.batch_size}:{self.n_records}:</resumptionToken>"
+        else:
+            token = "<resumptionToken/>"
+        return (f'<?xml version="1.0" encoding="UTF-8"?><OAI-PMH xmlns="{OAI_NS}">'
+                f'<responseDate>2023-01-01T00:00:00Z</responseDate>'
+                f'<request verb="ListRecords" set="test" metadataPrefix="marc21xml">{self.endpoint}</request>'
+                f'<ListRecords>{records}{token}</ListRecords></OAI-PMH>').encode("utf8")
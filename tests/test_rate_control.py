@@ -0,0 +1,178 @@
+"""
+Tests of the adaptive request rate: the RateController on its own, and fetch and iter_batches against
+a stand-in OAI-PMH endpoint (see oai_server.py) that throttles with 429/503 responses.
+"""
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+
+from harvester import fetch, iter_batches
+from rate_control import RateController, parse_retry_after
+from oai_server import StandInServer
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after(" 0 ") == 0.0
+    assert 8 <= parse_retry_after(formatdate(time.time() + 10, usegmt=True)) <= 10
+    assert parse_retry_after(formatdate(time.time() - 10, usegmt=True)) == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+
+
+def test_window_grows_by_about_one_per_window_of_successes():
+    controller = RateController(initial_concurrency=1, max_concurrency=4)
+    controller.on_success(0.1)
+    assert controller.concurrency == 2
+    successes = 1
+    while controller.concurrency < 4:
+        controller.on_success(0.1)
+        successes += 1
+    # 1 + 2 + 3 successes for windows of 1, 2 and 3, give or take the rounding
+    assert 6 <= successes <= 8
+    assert controller.counters["increases"] == 3
+    # never above max_concurrency
+    for _ in range(10):
+        controller.on_success(0.1)
+    assert controller.concurrency == 4
+
+
+def test_window_shrinks_on_throttling_at_most_once_per_round_trip():
+    controller = RateController(initial_concurrency=4, max_concurrency=4, backoff=0.01)
+    controller.on_success(0.5)
+    controller.on_throttle(0)
+    assert controller.concurrency == 2
+    # the other requests of the same window were sent before the decrease
+    controller.on_throttle(0)
+    controller.on_error()
+    assert controller.concurrency == 2
+    assert controller.counters["throttled"] == 2 and controller.counters["errors"] == 1
+    assert controller.counters["decreases"] == 1
+    assert [reason for _, reason, _ in controller.decisions] == ["throttled"]
+
+
+def test_window_stays_above_min_concurrency():
+    controller = RateController(initial_concurrency=2, min_concurrency=1, max_concurrency=4, backoff=0.01)
+    for _ in range(5):
+        controller.on_throttle(0)
+    assert controller.concurrency == 1
+
+
+def test_window_shrinks_on_slow_responses():
+    controller = RateController(initial_concurrency=4, max_concurrency=4, target_latency=1.0)
+    controller.on_success(0.1)
+    controller.on_success(10.0)
+    assert controller.concurrency == 2
+    assert controller.decisions[-1][1] == "latency"
+
+
+def test_baseline_follows_slow_drift_but_not_sudden_slowdowns():
+    controller = RateController(initial_concurrency=4, max_concurrency=4)
+    # the response times drift from 0.02 to 0.22 seconds over 100 responses
+    for i in range(100):
+        controller.on_success(0.02 + 0.002 * i)
+    assert controller.counters["decreases"] == 0
+    assert controller.baseline_latency > 0.1
+    # a sudden slowdown is still taken as overload
+    for _ in range(10):
+        controller.on_success(1.0)
+    assert controller.concurrency == 2
+    assert controller.decisions[-1][1] == "latency"
+
+
+def test_retry_after_is_not_shortened():
+    controller = RateController(max_backoff=60)
+    controller.on_throttle(120)
+    assert controller.paused_until - time.monotonic() > 119
+    # only the backoff without Retry-After is capped
+    controller = RateController(backoff=40, max_backoff=60)
+    controller.on_error()
+    controller.last_decrease = 0.0
+    controller.on_error()
+    assert controller.counters["backoff_seconds"] == 40 + 60
+
+
+def test_fetch_waits_for_retry_after():
+    with StandInServer(responses=[(429, {"Retry-After": "1"})]) as server:
+        controller = RateController()
+        content = fetch(server.URL, controller=controller)
+    assert b"oai:test:0" in content
+    assert [status for _, status, _ in server.requests] == [429, 200]
+    assert server.arrival_times()[1] >= 0.95
+    assert controller.counters["throttled"] == 1
+    assert controller.counters["backoff_seconds"] == 1.0
+
+
+def test_fetch_backs_off_exponentially_on_503_without_retry_after():
+    with StandInServer(responses=[(503, {}), (503, {})]) as server:
+        controller = RateController(backoff=0.2)
+        fetch(server.URL, controller=controller)
+    first, second, third = server.arrival_times()
+    assert second - first >= 0.19
+    assert third - second >= 0.39
+    # the backoff is reset by a successful response
+    assert controller.backoff == 0.2
+
+
+def test_fetch_gives_up_after_max_retries():
+    with StandInServer(responses=[(503, {"Retry-After": "0"})] * 3) as server:
+        with pytest.raises(requests.HTTPError):
+            fetch(server.URL, controller=RateController(), max_retries=2)
+    assert len(server.requests) == 3
+
+
+def test_fetch_raises_client_errors_without_retrying():
+    with StandInServer(responses=[(404, {})]) as server:
+        with pytest.raises(requests.HTTPError):
+            fetch(server.URL, controller=RateController())
+    assert len(server.requests) == 1
+
+
+def harvest(server: StandInServer, controller: RateController) -> list:
+    identifiers = []
+    for records, _ in iter_batches(server.URL, controller=controller):
+        identifiers += [record.findtext("{*}header/{*}identifier") for record in records]
+    return identifiers
+
+
+def test_iter_batches_grows_the_window():
+    with StandInServer(n_records=200, batch_size=10, latency=0.05) as server:
+        controller = RateController(initial_concurrency=1, max_concurrency=4)
+        identifiers = harvest(server, controller)
+    assert identifiers == [f"oai:test:{i}" for i in range(200)]
+    assert int(controller.concurrency) == 4
+    assert server.max_in_flight == 4
+    assert [reason for _, reason, _ in controller.decisions[:3]] == ["increase"] * 3
+
+
+def test_iter_batches_keeps_the_window_when_the_endpoint_drifts():
+    # offset cursors: the deeper the batch, the slower the response, whatever the load
+    with StandInServer(n_records=1000, batch_size=10, latency=lambda cursor: 0.02 + 0.2 * cursor / 1000) as server:
+        controller = RateController(initial_concurrency=1, max_concurrency=4)
+        identifiers = harvest(server, controller)
+    assert identifiers == [f"oai:test:{i}" for i in range(1000)]
+    assert "latency" not in [reason for _, reason, _ in controller.decisions]
+    assert int(controller.concurrency) == 4
+
+
+def test_iter_batches_shrinks_the_window_when_throttled():
+    # the endpoint only accepts two concurrent requests
+    def throttle(in_flight):
+        return (503, {}) if in_flight > 2 else None
+
+    with StandInServer(n_records=200, batch_size=10, latency=0.05, throttle=throttle) as server:
+        controller = RateController(initial_concurrency=4, max_concurrency=4, backoff=0.1)
+        identifiers = harvest(server, controller)
+    # the throttled batches were retried and all records arrive in order
+    assert identifiers == [f"oai:test:{i}" for i in range(200)]
+    reasons = [reason for _, reason, _ in controller.decisions]
+    assert reasons[0] == "throttled"
+    assert controller.decisions[0][2] == 2
+    # the window grows back after a decrease, until the endpoint throttles again
+    assert "increase" in reasons[1:]
+    assert reasons.count("throttled") >= 2
+    # with a fixed window of 4, about half of the requests would be throttled
+    assert controller.counters["throttled"] < controller.counters["successes"] / 2
+    assert controller.concurrency >= 1.5